@@ -50,10 +50,11 @@
 # The XORRequestor interface is used to address these issues.
 # The programmer defines an object that is provided the manifest,
 # mirrorlist, and blocks to retrieve.   The XORRequestor object must support
-# several methods: get_next_xorrequest(), notify_failure(xorrequest),
-# notify_success(xorrequest, xordata), and return_block(blocknum).   The
-# request_blocks_from_mirrors function in this file will use threads to call
-# these methods to determine what to retrieve.   The notify_* routines are
+# several methods: get_next_xorrequest(tid), notify_failure(tid),
+# notify_success(mirrorinfo, xordata), and return_block(blocknum).   The
+# request_blocks_from_mirrors function in this file will call these methods
+# from a single thread that multiplexes the sockets of all mirrors to
+# determine what to retrieve.   The notify_* routines are
 # used to inform the XORRequestor object of prior results so that it can
 # decide how to issue future block requests.   This separates out the 'what'
 # from the 'how' but has a slight loss of control.  Note that the block
@@ -70,11 +71,17 @@ import sys
 
 import optparse
 
+# to append the batches from a batch file
+import itertools
+
 # helper functions that are shared
 import raidpirlib as lib
 
-# used to issue requests in parallel
-import threading
+# used to talk to all mirrors in parallel from a single thread
+import selectors
+
+# to spread the mirrors over several event loops (--threads)
+import concurrent.futures
 
 import simplexorrequestor
 
@@ -87,78 +94,128 @@ import os.path
 import time
 _timer = lib._timer
 
+# how much to read from a mirror socket at once
+_recvbuffersize = 65536
 
-def _request_helper(rxgobj, tid):
-	"""Private helper to get requests.
-	Multiple threads will execute this, each with a unique tid."""
-	thisrequest = rxgobj.get_next_xorrequest(tid)
+# how many buffers to pass to a single writev call (IOV_MAX is at least 1024)
+_maxwritevbuffers = 1024
 
-	#the socket is fixed for each thread, so we only need to do this once
-	socket = thisrequest[0]['sock']
 
-	# go until there are no more requests
-	while thisrequest != ():
-		bitstring = thisrequest[2]
-		try:
-			# request the XOR block...
-			lib.request_xorblock(socket, bitstring)
-
-		except Exception as e:
-			if 'socked' in str(e):
-				rxgobj.notify_failure(thisrequest)
-				sys.stdout.write('F')
-				sys.stdout.flush()
-			else:
-				# otherwise, re-raise...
-				raise
+def _request_loop(rxgobj, tids, pipelinedepth):
+	"""Private helper to issue requests and receive the answers.
+	A single thread multiplexes the sockets of all mirrors given by tids.
+	At most pipelinedepth requests are outstanding per mirror (0: no limit)."""
 
-		# regardless of failure or success, get another request...
-		thisrequest = rxgobj.get_next_xorrequest(tid)
+	selector = selectors.DefaultSelector()
 
-	# and that's it!
-	return
+	for tid in tids:
+		mirror = rxgobj.activemirrors[tid]
 
+		#the socket is fixed for each mirror
+		sock = mirror['info']['sock']
+		sock.setblocking(False)
 
-def _request_helper_chunked(rxgobj, tid):
-	"""Private helper to get requests with chunks.
-	Potentially multiple threads will execute this, each with a unique tid."""
-	thisrequest = rxgobj.get_next_xorrequest(tid)
+		state = {'tid':tid, 'mirror':mirror, 'sendbufs':[], 'recvbuf':bytearray(), 'outstanding':0, 'done':False}
+		selector.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, state)
 
-	#the socket is fixed for each thread, so we only need to do this once
-	socket = thisrequest[0]['sock']
-	rqtype = thisrequest[3] #the request type is also fixed
+	# go until all mirrors have answered all requests
+	while selector.get_map():
+		for key, events in selector.select():
+			sock = key.fileobj
+			state = key.data
 
-	# go until there are no more requests
-	while thisrequest != ():
-		chunks = thisrequest[2]
+			if events & selectors.EVENT_WRITE:
+				if len(state['sendbufs']) == 0 and pipelinedepth and state['outstanding'] >= pipelinedepth:
+					# the pipeline is full, wait for an answer before sending more
+					selector.modify(sock, selectors.EVENT_READ, state)
 
-		try:
-			# request the XOR block...
-			if rqtype == 1: # chunks and seed expansion
-				lib.request_xorblock_chunked_rng(socket, chunks)
+				elif len(state['sendbufs']) == 0:
+					thisrequest = rxgobj.get_next_xorrequest(state['tid'])
 
-			elif rqtype == 2: # chunks, seed expansion and parallel
-				lib.request_xorblock_chunked_rng_parallel(socket, chunks)
+					if thisrequest == ():
+						# nothing left to send, only wait for the answers
+						state['done'] = True
+						selector.modify(sock, selectors.EVENT_READ, state)
 
-			else: # only chunks (redundancy)
-				lib.request_xorblock_chunked(socket, chunks)
+					else:
+						state['sendbufs'] = session.framebuffers(lib.pack_xorrequest_buffers(thisrequest))
+						state['outstanding'] = state['outstanding'] + 1
 
-		except Exception as e:
-			if 'socked' in str(e):
-				rxgobj.notify_failure(thisrequest)
-				sys.stdout.write('F')
-				sys.stdout.flush()
-			else:
-				# otherwise, re-raise...
-				raise
+				if len(state['sendbufs']) > 0:
+					try:
+						# request the XOR block, header and payload in one syscall...
+						if hasattr(sock, 'sendmsg'):
+							sent = sock.sendmsg(state['sendbufs'])
+						else:
+							sent = sock.send(b''.join(state['sendbufs']))
+						state['sendbufs'] = _skip_sent_bytes(state['sendbufs'], sent)
+
+					except BlockingIOError:
+						# the socket buffer is full, try again later
+						pass
+
+					except OSError:
+						# socket errors (but nothing else) let the requestor
+						# pick a different mirror
+						_replace_mirror(selector, sock, state, rxgobj)
+						continue
+
+			if events & selectors.EVENT_READ:
+				try:
+					data = sock.recv(_recvbuffersize)
+				except BlockingIOError:
+					continue
+				except OSError:
+					_replace_mirror(selector, sock, state, rxgobj)
+					continue
+
+				# the mirror closed the connection
+				if data == b'':
+					_replace_mirror(selector, sock, state, rxgobj)
+					continue
+
+				state['recvbuf'] += data
+
+				answers = session.popmessages(state['recvbuf'])
+
+				for xorblock in answers:
+					state['outstanding'] = state['outstanding'] - 1
+					rxgobj.notify_success(state['mirror']['info'], xorblock)
+
+				# there is room in the pipeline again
+				if answers and pipelinedepth and not state['done']:
+					selector.modify(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, state)
+
+			# this mirror is done, hand the socket back in blocking mode
+			if state['done'] and state['outstanding'] == 0:
+				selector.unregister(sock)
+				sock.setblocking(True)
 
-		# regardless of failure or success, get another request...
-		thisrequest = rxgobj.get_next_xorrequest(tid)
+	selector.close()
 
 	# and that's it!
 	return
 
 
+def _replace_mirror(selector, sock, state, rxgobj):
+	"""Private helper for a mirror whose connection failed. The requestor
+	replaces the mirror (or raises InsufficientMirrors) and the socket of the
+	replacement takes over the state of the old one."""
+
+	selector.unregister(sock)
+	rxgobj.notify_failure(state['tid'])
+
+	sock = state['mirror']['info']['sock']
+	sock.setblocking(False)
+
+	# the unanswered requests are sent again on the new connection
+	state['sendbufs'] = []
+	state['recvbuf'] = bytearray()
+	state['outstanding'] = 0
+	state['done'] = False
+	selector.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, state)
+
+
 def request_blocks_from_mirrors(requestedblocklist, manifestdict, redundancy, rng, parallel):
 	"""
 	<Purpose>
@@ -169,6 +226,7 @@ def request_blocks_from_mirrors(requestedblocklist, manifestdict, redundancy, rn
 
 		manifestdict: the manifest with information about the release
 
+
 	<Side Effects>
 		Contacts mirrors to retrieve blocks. It uses some global options
 
@@ -180,83 +238,129 @@ def request_blocks_from_mirrors(requestedblocklist, manifestdict, redundancy, rn
 		A dict mapping blocknumber -> blockcontents.
 	"""
 
+	for blockdict in request_block_batches_from_mirrors([requestedblocklist], manifestdict, redundancy, rng, parallel):
+		retdict = blockdict
+
+	return retdict
+
+
+def request_block_batches_from_mirrors(blockbatches, manifestdict, redundancy, rng, parallel):
+	"""
+	<Purpose>
+		Retrieves several batches of blocks from mirrors in one session. The
+		mirror list is retrieved and the mirrors are set up only once, every
+		batch then only costs its queries.
+
+	<Arguments>
+		blockbatches: an iterable of lists of blocks to acquire. It is only
+		advanced when the previous batch has been retrieved.
+
+		manifestdict: the manifest with information about the release
+
+
+	<Side Effects>
+		Contacts mirrors to retrieve blocks. It uses some global options
+
+	<Exceptions>
+		TypeError may be raised if the provided lists are invalid.
+		socket errors may be raised if communications fail.
+
+	<Returns>
+		A generator that yields a dict mapping blocknumber -> blockcontents
+		for every batch.
+	"""
+
 	# let's get the list of mirrors...
 	if _commandlineoptions.vendorip == None:
 		# use data from manifest
-		mirrorinfolist = lib.retrieve_mirrorinfolist(manifestdict['vendorhostname'], manifestdict['vendorport'])
+		mirrorinfolist = lib.retrieve_mirrorinfolist(manifestdict['vendorhostname'], manifestdict['vendorport'], usecapnp=_commandlineoptions.capnp, usezstd=_commandlineoptions.zstd)
 	else:
 		# use commandlineoption
-		mirrorinfolist = lib.retrieve_mirrorinfolist(_commandlineoptions.vendorip)
+		mirrorinfolist = lib.retrieve_mirrorinfolist(_commandlineoptions.vendorip, usecapnp=_commandlineoptions.capnp, usezstd=_commandlineoptions.zstd)
 
 	print("Mirrors: ", mirrorinfolist)
 
-	if _commandlineoptions.timing:
-		setup_start = _timer()
+	rxgobj = None
+	setup_time = 0
+	req_time = 0
+
+	# the event loops of all batches run on the same threads
+	threads = min(_commandlineoptions.threads, _commandlineoptions.numberofmirrors, (os.cpu_count() or 1) * 2)
+	if threads > 1:
+		executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+	else:
+		executor = None
 
-	# no chunks (regular upPIR / Chor)
-	if redundancy == None:
+	try:
+		for requestedblocklist in blockbatches:
 
-		# let's set up a requestor object...
-		rxgobj = simplexorrequestor.RandomXORRequestor(mirrorinfolist, requestedblocklist, manifestdict, _commandlineoptions.numberofmirrors, _commandlineoptions.batch, _commandlineoptions.timing)
+			if _commandlineoptions.timing:
+				setup_start = _timer()
 
-		if _commandlineoptions.timing:
-			setup_time = _timer() - setup_start
-			_timing_log.write(str(len(rxgobj.activemirrors[0]['blockbitstringlist']))+"\n")
-			_timing_log.write(str(len(rxgobj.activemirrors[0]['blockbitstringlist']))+"\n")
+			# no chunks (regular upPIR / Chor)
+			if redundancy == None:
 
-		print("Blocks to request:", len(rxgobj.activemirrors[0]['blockbitstringlist']))
+				# let's set up a requestor object for the first batch...
+				if rxgobj == None:
+					rxgobj = simplexorrequestor.RandomXORRequestor(mirrorinfolist, requestedblocklist, manifestdict, _commandlineoptions.numberofmirrors, _commandlineoptions.batch, _commandlineoptions.timing)
+				else:
+					rxgobj.next_batch(requestedblocklist)
 
-		if _commandlineoptions.timing:
-			req_start = _timer()
+				if _commandlineoptions.timing:
+					setup_time = setup_time + _timer() - setup_start
+					_timing_log.write(str(len(rxgobj.activemirrors[0]['blockbitstringlist']))+"\n")
+					_timing_log.write(str(len(rxgobj.activemirrors[0]['blockbitstringlist']))+"\n")
 
-		# let's fire up the requested number of threads.   Our thread will also participate (-1 because of us!)
-		for tid in range(_commandlineoptions.numberofmirrors - 1):
-			threading.Thread(target=_request_helper, args=[rxgobj, tid]).start()
+				print("Blocks to request:", len(rxgobj.activemirrors[0]['blockbitstringlist']))
 
-		_request_helper(rxgobj, _commandlineoptions.numberofmirrors - 1)
+			else: # chunks
 
-		# wait for receiving threads to finish
-		for mirror in rxgobj.activemirrors:
-			mirror['rt'].join()
+				# let's set up a chunk requestor object for the first batch...
+				if rxgobj == None:
+					rxgobj = simplexorrequestor.RandomXORRequestorChunks(mirrorinfolist, requestedblocklist, manifestdict, _commandlineoptions.numberofmirrors, redundancy, rng, parallel, _commandlineoptions.batch, _commandlineoptions.timing)
+				else:
+					rxgobj.next_batch(requestedblocklist)
 
-	else: # chunks
+				if _commandlineoptions.timing:
+					setup_time = setup_time + _timer() - setup_start
+					_timing_log.write(str(len(rxgobj.activemirrors[0]['blocksneeded']))+"\n")
+					_timing_log.write(str(len(rxgobj.activemirrors[0]['blockchunklist']))+"\n")
 
-		# let's set up a chunk requestor object...
-		rxgobj = simplexorrequestor.RandomXORRequestorChunks(mirrorinfolist, requestedblocklist, manifestdict, _commandlineoptions.numberofmirrors, redundancy, rng, parallel, _commandlineoptions.batch, _commandlineoptions.timing)
+				print("# Blocks needed:", len(rxgobj.activemirrors[0]['blocksneeded']))
 
-		if _commandlineoptions.timing:
-			setup_time = _timer() - setup_start
-			_timing_log.write(str(len(rxgobj.activemirrors[0]['blocksneeded']))+"\n")
-			_timing_log.write(str(len(rxgobj.activemirrors[0]['blockchunklist']))+"\n")
+				if parallel:
+					print("# Requests:", len(rxgobj.activemirrors[0]['blockchunklist']))
 
-		print("# Blocks needed:", len(rxgobj.activemirrors[0]['blocksneeded']))
+			if _commandlineoptions.timing:
+				req_start = _timer()
 
-		if parallel:
-			print("# Requests:", len(rxgobj.activemirrors[0]['blockchunklist']))
+			# send all requests and receive the answers
+			_run_request_loops(rxgobj, executor, threads)
 
-		#chunk lengths in BYTE
-		global chunklen
-		global lastchunklen
-		chunklen = (manifestdict['blockcount'] / 8) / _commandlineoptions.numberofmirrors
-		lastchunklen = lib.bits_to_bytes(manifestdict['blockcount']) - (_commandlineoptions.numberofmirrors-1)*chunklen
+			if _commandlineoptions.timing:
+				req_time = req_time + _timer() - req_start
 
-		if _commandlineoptions.timing:
-			req_start = _timer()
+			if rxgobj.failurecount > 0:
+				print(rxgobj.failurecount, "failures")
 
-		# let's fire up the requested number of threads.   Our thread will also participate (-1 because of us!)
-		for tid in range(_commandlineoptions.numberofmirrors - 1):
-			threading.Thread(target=_request_helper_chunked, args=[rxgobj, tid]).start()
+			# okay, now we have them all. Let's get the returned dict ready.
+			retdict = {}
+			for blocknum in requestedblocklist:
+				retdict[blocknum] = rxgobj.return_block(blocknum)
 
-		_request_helper_chunked(rxgobj, _commandlineoptions.numberofmirrors - 1)
+			yield retdict
 
-		# wait for receiving threads to finish
-		for mirror in rxgobj.activemirrors:
-			mirror['rt'].join()
+	finally:
+		if executor != None:
+			executor.shutdown()
+
+	# there was nothing to retrieve
+	if rxgobj == None:
+		return
 
 	rxgobj.cleanup()
 
 	if _commandlineoptions.timing:
-		req_time = _timer() - req_start
 		recons_time, comptimes, pings = rxgobj.return_timings()
 
 		avg_ping = sum(pings) / _commandlineoptions.numberofmirrors
@@ -268,12 +372,74 @@ def request_blocks_from_mirrors(requestedblocklist, manifestdict, redundancy, rn
 		_timing_log.write(str(avg_comptime)+ " " + str(comptimes)+ "\n")
 		_timing_log.write(str(avg_ping)+ " " + str(pings)+ "\n")
 
-	# okay, now we have them all. Let's get the returned dict ready.
-	retdict = {}
-	for blocknum in requestedblocklist:
-		retdict[blocknum] = rxgobj.return_block(blocknum)
 
-	return retdict
+def _run_request_loops(rxgobj, executor, threads):
+	"""Private helper that sends all requests and receives the answers. Without
+	an executor a single event loop serves all mirrors, otherwise the mirrors
+	are split among threads event loops on the worker threads of the executor."""
+
+	if executor == None:
+		_request_loop(rxgobj, range(_commandlineoptions.numberofmirrors), _commandlineoptions.pipelinedepth)
+		return
+
+	tidpartitions = [range(i, _commandlineoptions.numberofmirrors, threads) for i in range(threads)]
+
+	# list() waits for all loops and raises their exceptions
+	list(executor.map(lambda tids: _request_loop(rxgobj, tids, _commandlineoptions.pipelinedepth), tidpartitions))
+
+
+def _skip_sent_bytes(buffers, sent):
+	"""Private helper that drops the first sent bytes from a list of buffers"""
+
+	while len(buffers) > 0 and sent >= len(buffers[0]):
+		sent = sent - len(buffers[0])
+		buffers = buffers[1:]
+
+	# keep the rest of a partially sent buffer
+	if sent > 0:
+		buffers[0] = memoryview(buffers[0])[sent:]
+
+	return buffers
+
+
+def _write_file(filename, pieces):
+	"""Private helper to write a list of buffers to a file with as few
+	syscalls as possible. The client does not read the file again, so its
+	pages are dropped from the page cache afterwards where supported."""
+
+	flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+
+	# don't update the access time (Linux only)
+	try:
+		fd = os.open(filename, flags | getattr(os, 'O_NOATIME', 0), 0o644)
+	except PermissionError:
+		# O_NOATIME is only allowed on our own files
+		fd = os.open(filename, flags, 0o644)
+
+	try:
+		i = 0
+		while i < len(pieces):
+			if hasattr(os, 'writev'):
+				written = os.writev(fd, pieces[i:i + _maxwritevbuffers])
+			else:
+				written = os.write(fd, pieces[i])
+
+			# skip the buffers that were written completely...
+			while i < len(pieces) and written >= len(pieces[i]):
+				written = written - len(pieces[i])
+				i = i + 1
+
+			# ...and keep the rest of a partially written one
+			if written > 0:
+				pieces[i] = pieces[i][written:]
+
+		# only clean pages can be dropped, so flush them first
+		if hasattr(os, 'posix_fadvise'):
+			os.fdatasync(fd)
+			os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+	finally:
+		os.close(fd)
 
 
 def request_files_from_mirrors(requestedfilelist, redundancy, rng, parallel, manifestdict):
@@ -299,45 +465,108 @@ def request_files_from_mirrors(requestedfilelist, redundancy, rng, parallel, man
 		None
 	"""
 
-	neededblocks = []
-	#print "Request Files:"
-	# let's figure out what blocks we need
-	for filename in requestedfilelist:
-		theseblocks = lib.get_blocklist_for_file(filename, manifestdict)
+	request_file_batches_from_mirrors([requestedfilelist], redundancy, rng, parallel, manifestdict)
+
+
+def request_file_batches_from_mirrors(filebatches, redundancy, rng, parallel, manifestdict):
+	"""
+	<Purpose>
+		Reconstitutes several batches of files in a single PIR session.
+		The files of a batch are written before the next batch is requested.
+
+	<Arguments>
+		filebatches: an iterable of lists of files to acquire
+		redundancy: use chunks and overlap this often
+		rng: use rnd to generate latter chunks
+		parallel: query one block per chunk
+		manifestdict: the manifest with information about the release
 
-		# add the blocks we don't already know we need to request
-		for blocknum in theseblocks:
-			if blocknum not in neededblocks:
-				neededblocks.append(blocknum)
+	<Side Effects>
+		Contacts mirrors to retrieve files. They are written to disk
+
+	<Exceptions>
+		TypeError may be raised if the provided lists are invalid.
+		socket errors may be raised if communications fail.
+
+	<Returns>
+		None
+	"""
+
+	# the file batches whose blocks are being retrieved, in order
+	pendingfilebatches = []
+
+	def _blockbatches():
+		for requestedfilelist in filebatches:
+			neededblocks = set()
+			#print "Request Files:"
+			# let's figure out what blocks we need
+			for filename in requestedfilelist:
+				# add the blocks we don't already know we need to request
+				neededblocks.update(lib.get_blocklist_for_file(filename, manifestdict))
+
+			pendingfilebatches.append(requestedfilelist)
+			yield sorted(neededblocks)
 
 	# do the actual retrieval work
-	blockdict = request_blocks_from_mirrors(neededblocks, manifestdict, redundancy, rng, parallel)
+	for blockdict in request_block_batches_from_mirrors(_blockbatches(), manifestdict, redundancy, rng, parallel):
+		_write_files(pendingfilebatches.pop(0), manifestdict, blockdict)
+
+
+def _write_files(requestedfilelist, manifestdict, blockdict):
+	"""Private helper that checks and writes out the files of one batch"""
 
-	# now we should write out the files
 	for filename in requestedfilelist:
-		filedata = lib.extract_file_from_blockdict(filename, manifestdict, blockdict)
 
-		# let's check the hash
-		thisfilehash = lib.find_hash(filedata, manifestdict['hashalgorithm'])
-
-		for fileinfo in manifestdict['fileinfolist']:
-			# find this entry
-			if fileinfo['filename'] == filename:
-				if thisfilehash == fileinfo['hash']:
-					# we found it and it checks out!
-					break
-				else:
-					raise Exception("Corrupt manifest has incorrect file hash despite passing block hash checks!")
-		else:
+		# find this entry
+		try:
+			fileinfo = lib.get_fileinfo_for_file(filename, manifestdict)
+		except TypeError:
 			raise Exception("Internal Error: Cannot locate fileinfo in manifest!")
 
+		# the pieces of the file are views into the blocks, so the file is
+		# never assembled in memory
+		pieces = []
+		hashobj = lib.new_hash(manifestdict['hashalgorithm'])
+
+		for _, _, piece in lib.iter_file_blocks(filename, manifestdict, blockdict):
+			pieces.append(piece)
+			if hashobj != None:
+				hashobj.update(piece)
+
+		# let's check the hash
+		thisfilehash = lib.hash_digest(hashobj, manifestdict['hashalgorithm'])
+
+		if thisfilehash != fileinfo['hash']:
+			raise Exception("Corrupt manifest has incorrect file hash despite passing block hash checks!")
 
 		# open the filename w/o the dir and write it
 		filenamewithoutpath = os.path.basename(filename)
-		open(filenamewithoutpath, "wb").write(filedata)
+		_write_file(filenamewithoutpath, pieces)
 		print("wrote", filenamewithoutpath)
 
 
+def _read_batchfile(batchfilename, filelist):
+	"""Private helper that yields the batches listed in a batch file. Every
+	line holds one batch of whitespace separated filenames. The file is only
+	read as far as the batches are retrieved."""
+
+	with open(batchfilename) as batchfo:
+		for line in batchfo:
+			requestedfilelist = line.split()
+
+			# skip empty lines
+			if len(requestedfilelist) == 0:
+				continue
+
+			# ensure the requested files are in the release
+			for filename in requestedfilelist:
+				if filename not in filelist:
+					print("The file", filename, "is not listed in the manifest.")
+					sys.exit(2)
+
+			yield requestedfilelist
+
+
 ########################## Option parsing and main ###########################
 _commandlineoptions = None
 
@@ -378,6 +607,12 @@ def parse_options():
 	parser.add_option("", "--vendorip", dest="vendorip", type="string", metavar="IP",
 				default=None, help="Vendor IP for overwriting the value from manifest; for testing purposes.")
 
+	parser.add_option("", "--capnp", action="store_true", dest="capnp", default=False,
+				help="Retrieve the mirror list from the vendor in Cap'n Proto format, requires the capnp module (default False, msgpack)")
+
+	parser.add_option("", "--zstd", action="store_true", dest="zstd", default=False,
+				help="Retrieve the mirror list from the vendor compressed with zstd, requires the zstandard module (default False)")
+
 	parser.add_option("-m", "--manifestfile", dest="manifestfilename",
 				type="string", default="manifest.dat",
 				help="The manifest file to use (default manifest.dat).")
@@ -396,6 +631,16 @@ def parse_options():
 	parser.add_option("-p", "--parallel", action="store_true", dest="parallel", default=False,
 				help="Query one block per chunk in parallel (default False). Requires -r")
 
+	parser.add_option("", "--pipelinedepth", dest="pipelinedepth",
+				type="int", default=0,
+				help="How many requests may be outstanding per mirror? (default 0, no limit)")
+
+	parser.add_option("", "--threads", dest="threads", metavar="number", type="int",
+				default=1, help="Number of threads that talk to the mirrors, at most one per mirror (default: 1, a single thread serves all mirrors)")
+
+	parser.add_option("", "--batchfile", dest="batchfile", type="string", metavar="FILE",
+				default=None, help="Retrieve further batches of files listed in FILE, one batch of filenames per line, in the same session")
+
 	parser.add_option("-b", "--batch", action="store_true", dest="batch", default=False,
 				help="Request the mirror to do computations in a batch. (default False)")
 
@@ -420,6 +665,26 @@ def parse_options():
 		print("Mirrors to contact must be > 1")
 		sys.exit(1)
 
+	if _commandlineoptions.threads < 1:
+		print("Number of threads must be positive")
+		sys.exit(1)
+
+	if _commandlineoptions.pipelinedepth < 0:
+		print("Pipeline depth must not be negative")
+		sys.exit(1)
+
+	if _commandlineoptions.capnp and lib.capnp_error != None:
+		print("--capnp: " + lib.capnp_error)
+		sys.exit(1)
+
+	if _commandlineoptions.zstd and lib.zstandard == None:
+		print("--zstd requires the zstandard module (https://pypi.org/project/zstandard/)")
+		sys.exit(1)
+
+	if _commandlineoptions.capnp and _commandlineoptions.zstd:
+		print("Only one of --capnp and --zstd can be used")
+		sys.exit(1)
+
 	# r >= 2
 	if _commandlineoptions.redundancy != None and _commandlineoptions.redundancy < 2:
 		print("Redundancy must be > 1")
@@ -435,7 +700,7 @@ def parse_options():
 		print("Chunks must be enabled and redundancy set (-r <number>) to use RNG or parallel queries!")
 		sys.exit(1)
 
-	if len(remainingargs) == 0 and _commandlineoptions.printfiles == False:
+	if len(remainingargs) == 0 and _commandlineoptions.printfiles == False and _commandlineoptions.batchfile == None:
 		print("Must specify at least one file to retrieve!")
 		sys.exit(1)
 
@@ -459,7 +724,8 @@ def start_logging():
 			logfilename += "_b"
 
 		cur_time = time.strftime("%y%m%d-%H%M%S")
-		_timing_log = open("timing_" + logfilename + ".log", "a")
+		# the log is written by a background thread, away from the timed code
+		_timing_log = lib.QueuedWriter(open("timing_" + logfilename + ".log", "a"))
 		_timing_log.write(cur_time + "\n")
 		_timing_log.write(str(_commandlineoptions.filestoretrieve) + " ")
 		_timing_log.write(str(_commandlineoptions.numberofmirrors) + " ")
@@ -485,11 +751,13 @@ def main():
 		manifestdict = lib.parse_manifest(rawmanifestdata)
 
 		# ...and write it out if it's okay
-		open(_commandlineoptions.manifestfilename, "wb").write(rawmanifestdata)
+		with open(_commandlineoptions.manifestfilename, "wb") as manifestfo:
+			manifestfo.write(rawmanifestdata)
 
 	else:
 		# Simply read it in from disk
-		rawmanifestdata = open(_commandlineoptions.manifestfilename, "rb").read()
+		with open(_commandlineoptions.manifestfilename, "rb") as manifestfo:
+			rawmanifestdata = manifestfo.read()
 
 		manifestdict = lib.parse_manifest(rawmanifestdata)
 
@@ -516,9 +784,18 @@ def main():
 			print("The file", filename, "is not listed in the manifest.")
 			sys.exit(2)
 
-	# don't run PIR if we're just printing the filenames in the manifest
+	# the files on the command line are the first batch
+	filebatches = []
 	if len(_commandlineoptions.filestoretrieve) > 0:
-		request_files_from_mirrors(_commandlineoptions.filestoretrieve, _commandlineoptions.redundancy, _commandlineoptions.rng, _commandlineoptions.parallel, manifestdict)
+		filebatches.append(_commandlineoptions.filestoretrieve)
+
+	# ...followed by the ones from the batch file
+	if _commandlineoptions.batchfile != None:
+		filebatches = itertools.chain(filebatches, _read_batchfile(_commandlineoptions.batchfile, filelist))
+
+	# don't run PIR if we're just printing the filenames in the manifest
+	if len(_commandlineoptions.filestoretrieve) > 0 or _commandlineoptions.batchfile != None:
+		request_file_batches_from_mirrors(filebatches, _commandlineoptions.redundancy, _commandlineoptions.rng, _commandlineoptions.parallel, manifestdict)
 
 if __name__ == '__main__':
 	print("RAID-PIR Client", lib.pirversion)
@@ -527,9 +804,14 @@ if __name__ == '__main__':
 	if _commandlineoptions.timing:
 		start_logging()
 
-	main()
+	try:
+		main()
 
-	if _commandlineoptions.timing:
-		ttime = _timer() - total_start
-		_timing_log.write(str(ttime)+ "\n")
-		_timing_log.close()
+		if _commandlineoptions.timing:
+			ttime = _timer() - total_start
+			_timing_log.write(str(ttime)+ "\n")
+
+	finally:
+		# write out what is still queued, even if the retrieval failed
+		if _commandlineoptions.timing:
+			_timing_log.close()
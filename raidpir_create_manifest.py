@@ -92,7 +92,7 @@ def parse_options():
 
 	parser.add_option("-H", "--hashalgorithm", dest="hashalgorithm", type="string",
 				metavar="algorithm", default="sha256-raw",
-				help="Chooses which algorithm to use for the secure hash (default sha256-raw)")
+				help="Chooses which algorithm to use for the secure hash (default sha256-raw). blake3-raw is faster but requires the blake3 module.")
 
 	parser.add_option("-o", "--offsetalgorithm", dest="offsetalgorithm",
 				type="string", metavar="algorithm", default="nogaps",
@@ -128,9 +128,54 @@ def parse_options():
 		print("Invalid vendorport")
 		sys.exit(1)
 
+	# check the hash algorithm before spending time on the files
+	try:
+		lib.find_hash(b'', commandlineoptions.hashalgorithm)
+	except (TypeError, ValueError) as e:
+		print("Invalid hash algorithm:", e)
+		sys.exit(1)
+
 	return commandlineoptions
 
 
+def write_manifest(manifestdict, manifestfo):
+	"""
+	<Purpose>
+		Serializes the manifest with msgpack piece by piece. The result is the
+		same as msgpack.packb(manifestdict), but the large lists are written
+		entry by entry instead of being packed in memory as a whole.
+
+	<Arguments>
+		manifestdict: the manifest dictionary
+
+		manifestfo: a file object opened for writing in binary mode
+
+	<Side Effects>
+		Writes to manifestfo
+
+	<Returns>
+		None
+	"""
+
+	packer = msgpack.Packer(use_bin_type=True)
+
+	# keys starting with '_' are lookup tables that are rebuilt when parsing
+	keys = [key for key in manifestdict if not key.startswith('_')]
+
+	manifestfo.write(packer.pack_map_header(len(keys)))
+
+	for key in keys:
+		value = manifestdict[key]
+		manifestfo.write(packer.pack(key))
+
+		if type(value) == list:
+			manifestfo.write(packer.pack_array_header(len(value)))
+			for entry in value:
+				manifestfo.write(packer.pack(entry))
+		else:
+			manifestfo.write(packer.pack(value))
+
+
 if __name__ == '__main__':
 
 	print("RAID-PIR create manifest", lib.pirversion)
@@ -143,18 +188,11 @@ if __name__ == '__main__':
 		block_size=commandlineoptions.blocksize,
 		datastore_layout=commandlineoptions.offsetalgorithm,
 		vendorhostname=commandlineoptions.vendorhostname,
-		vendorport=commandlineoptions.vendorport)
-
-	# open the destination file
-	manifestfo = open(commandlineoptions.manifestfile, 'wb')
-
-	# and write it in a safely serialized format (msgpack).
-	rawmanifest = msgpack.packb(manifestdict, use_bin_type=True)
-	manifestfo.write(rawmanifest)
-
-	manifestfo.close()
+		vendorport=commandlineoptions.vendorport,
+		database=commandlineoptions.database)
 
-	if commandlineoptions.database != None:
-		lib._write_db(commandlineoptions.rootdir, commandlineoptions.database)
+	# open the destination file and write it in a safely serialized format (msgpack).
+	with open(commandlineoptions.manifestfile, 'wb') as manifestfo:
+		write_manifest(manifestdict, manifestfo)
 
 	print("Generated manifest", commandlineoptions.manifestfile, "with", manifestdict['blockcount'], manifestdict['blocksize'], 'Byte blocks.')
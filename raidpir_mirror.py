@@ -108,38 +108,63 @@ def _send_mirrorinfo():
 
 
 #################### Batch Answer Thread ######################
-def BatchAnswer(parallel, chunknumbers, sock):
-	global _batchrequests
-	global _xorstrings
-	global _finish
-	global _batch_comp_time
+class BatchState(object):
+	"""the queued requests of one connection in batch mode. Each connection
+	has its own, so a new connection can't take over (or stop) the batch
+	thread of one that is just closing"""
+
+	def __init__(self):
+		self.requests = 0
+		self.xorstrings = b''
+		self.comptime = 0
+		self.finish = False
+		self.lock = threading.Lock()
+		self.event = threading.Event()
+
+
+	def add(self, bitstring):
+		"""queues the bitstring(s) of one request and wakes the batch thread"""
+		with self.lock:
+			self.xorstrings += bitstring
+			self.requests = self.requests + 1
+
+		# notify batch thread
+		self.event.set()
+
+
+	def stop(self):
+		"""lets the batch thread return"""
+		self.finish = True
+		self.event.set()
+
+
+def BatchAnswer(parallel, chunknumbers, sock, batchstate):
 
 	blocksize = _global_myxordatastore.sizeofblocks
-	_batch_comp_time = 0;
 
 	# while a client is connected
-	while not _finish:
+	while not batchstate.finish:
 
 		# wait for signal to start
-		_batchevent.wait()
+		batchstate.event.wait()
 
-		# create local copies and reset global values
-		with _batchlock:
-			batchrequests = _batchrequests
-			xorstrings = _xorstrings
-			_batchrequests = 0
-			_xorstrings = b''
+		# create local copies and reset the queue
+		with batchstate.lock:
+			batchrequests = batchstate.requests
+			xorstrings = batchstate.xorstrings
+			batchstate.requests = 0
+			batchstate.xorstrings = b''
 
 		if batchrequests == 0:
 			# all request answered, remove flag and wait/return
-			_batchevent.clear()
+			batchstate.event.clear()
 
 		else: # answer requests
 			start_time = _timer()
 
 			if parallel:
 				xoranswer = _global_myxordatastore.produce_xor_from_multiple_bitstrings(xorstrings, batchrequests*len(chunknumbers))
-				_batch_comp_time = _batch_comp_time + _timer() - start_time
+				batchstate.comptime = batchstate.comptime + _timer() - start_time
 				i = 0
 				for _ in range(batchrequests):
 					result = {}
@@ -151,7 +176,7 @@ def BatchAnswer(parallel, chunknumbers, sock):
 
 			else:
 				xoranswer = _global_myxordatastore.produce_xor_from_multiple_bitstrings(xorstrings, batchrequests)
-				_batch_comp_time = _batch_comp_time + _timer() - start_time
+				batchstate.comptime = batchstate.comptime + _timer() - start_time
 				for i in range(batchrequests):
 					session.sendmessage(sock, xoranswer[i*blocksize : (i+1)*blocksize])
 
@@ -166,19 +191,13 @@ class ThreadedXORRequestHandler(socketserver.BaseRequestHandler):
 
 	def handle(self):
 
-		global _batchrequests
-		global _xorstrings
-		global _finish
-		global _batch_comp_time
 		global _global_myxordatastore
 		global _global_manifestdict
 		global _request_restart
 
-		_finish = False
 		comp_time = 0
-		_batch_comp_time = 0
-		_batchrequests = 0
-		_xorstrings = b''
+		# replaced when the params ask for batch mode
+		batchstate = BatchState()
 		parallel = False
 
 		requeststring = b'0'
@@ -202,8 +221,7 @@ class ThreadedXORRequestHandler(socketserver.BaseRequestHandler):
 					# Invalid request length...
 					#_log("RAID-PIR "+remoteip+" "+str(remoteport)+" Invalid request with length: "+str(len(bitstring)))
 					session.sendmessage(self.request, 'Invalid request length')
-					_finish = True
-					_batchevent.set()
+					batchstate.stop()
 					return
 
 				if not batch:
@@ -217,12 +235,7 @@ class ThreadedXORRequestHandler(socketserver.BaseRequestHandler):
 
 				else:
 
-					with _batchlock:
-						_xorstrings += bitstring
-						_batchrequests = _batchrequests + 1
-
-					# notify batch thread
-					_batchevent.set()
+					batchstate.add(bitstring)
 
 				# done!
 
@@ -244,12 +257,7 @@ class ThreadedXORRequestHandler(socketserver.BaseRequestHandler):
 					#_log("RAID-PIR "+remoteip+" "+str(remoteport)+" GOOD")
 
 				else:
-					with _batchlock:
-						_xorstrings += bitstring
-						_batchrequests = _batchrequests + 1
-
-					# notify batch thread
-					_batchevent.set()
+					batchstate.add(bitstring)
 
 				#done!
 
@@ -282,12 +290,7 @@ class ThreadedXORRequestHandler(socketserver.BaseRequestHandler):
 					#_log("RAID-PIR "+remoteip+" "+str(remoteport)+" GOOD")
 
 				else:
-					with _batchlock:
-						_xorstrings += bitstring
-						_batchrequests = _batchrequests + 1
-
-					# notify batch thread
-					_batchevent.set()
+					batchstate.add(bitstring)
 
 				#done!
 
@@ -326,13 +329,7 @@ class ThreadedXORRequestHandler(socketserver.BaseRequestHandler):
 					# and send the reply.
 					session.sendmessage(self.request, msgpack.packb(result, use_bin_type=True))
 				else:
-					with _batchlock:
-						for c in chunknumbers:
-							_xorstrings += bitstrings[c]
-						_batchrequests = _batchrequests + 1
-
-					# notify batch thread
-					_batchevent.set()
+					batchstate.add(b''.join(bitstrings[c] for c in chunknumbers))
 
 				#_log("RAID-PIR "+remoteip+" "+str(remoteport)+" GOOD")
 				#done!
@@ -355,8 +352,12 @@ class ThreadedXORRequestHandler(socketserver.BaseRequestHandler):
 					cipher = lib.initAES(params['s'])
 
 				if batch:
+					# if params were sent before, that batch thread is done
+					batchstate.stop()
+					batchstate = BatchState()
+
 					# create batch xor thread
-					t = threading.Thread(target=BatchAnswer, args=[parallel, chunknumbers, self.request], name="RAID-PIR Batch XOR")
+					t = threading.Thread(target=BatchAnswer, args=[parallel, chunknumbers, self.request, batchstate], name="RAID-PIR Batch XOR")
 					t.daemon = True
 					t.start()
 
@@ -367,9 +368,9 @@ class ThreadedXORRequestHandler(socketserver.BaseRequestHandler):
 
 			#Timing Request
 			elif requeststring == b'T':
-				session.sendmessage(self.request, b"T" + str(comp_time + _batch_comp_time))
+				session.sendmessage(self.request, b"T" + str(comp_time + batchstate.comptime))
 				comp_time = 0
-				_batch_comp_time = 0
+				batchstate.comptime = 0
 
 			#Debug Hello
 			elif requeststring == b'HELLO':
@@ -380,15 +381,13 @@ class ThreadedXORRequestHandler(socketserver.BaseRequestHandler):
 			#the client asked to close the connection
 			elif requeststring == b'Q':
 				comp_time = 0
-				_finish = True
-				_batchevent.set()
+				batchstate.stop()
 				return
 
 			#this happens if the client closed the socket unexpectedly
 			elif requeststring == b'':
 				comp_time = 0
-				_finish = True
-				_batchevent.set()
+				batchstate.stop()
 				return
 
 			else:
@@ -396,8 +395,7 @@ class ThreadedXORRequestHandler(socketserver.BaseRequestHandler):
 				#_log("RAID-PIR "+remoteip+" "+str(remoteport)+" Invalid request type starts:'"+requeststring[:5]+"'")
 
 				session.sendmessage(self.request, 'Invalid request type')
-				_finish = True
-				_batchevent.set()
+				batchstate.stop()
 				return
 
 
@@ -434,20 +432,20 @@ class MyHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
 			requestedfilename = requestedfilename[1:]
 
 		# let's look for the file...
-		for fileinfo in _global_manifestdict['fileinfolist']:
-			# great, let's serve it!
-			if requestedfilename == fileinfo['filename']:
-				# it's a good query!  Send 200!
-				self.send_response(200)
-				self.end_headers()
-
-				# and send the response!
-				filedata = _global_myxordatastore.get_data(fileinfo['offset'], fileinfo['length'])
-				self.wfile.write(filedata)
-				return
-
-		# otherwise, it's unknown...
-		self.send_error(404)
+		try:
+			fileinfo = lib.get_fileinfo_for_file(requestedfilename, _global_manifestdict)
+		except TypeError:
+			# otherwise, it's unknown...
+			self.send_error(404)
+			return
+
+		# great, let's serve it! it's a good query!  Send 200!
+		self.send_response(200)
+		self.end_headers()
+
+		# and send the response!
+		filedata = _global_myxordatastore.get_data(fileinfo['offset'], fileinfo['length'])
+		self.wfile.write(filedata)
 		return
 
 	# log HTTP information
@@ -593,10 +591,6 @@ def parse_options():
 def main():
 	global _global_myxordatastore
 	global _global_manifestdict
-	global _batchlock
-	global _batchevent
-	global _xorstrings
-	global _batchrequests
 	global _request_restart
 
 	manifestdict = retrieve_manifest_dict()
@@ -632,10 +626,6 @@ def main():
 	# an ugly hack, but Python's request handlers don't have an easy way to pass arguments
 	_global_myxordatastore = myxordatastore
 	_global_manifestdict = manifestdict
-	_batchlock = threading.Lock()
-	_batchevent = threading.Event()
-	_batchrequests = 0
-	_xorstrings = b''
 
 	# first, let's fire up the RAID-PIR server
 	xorserver = service_raidpir_clients(myxordatastore, _commandlineoptions.ip, _commandlineoptions.port)
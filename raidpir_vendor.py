@@ -43,8 +43,8 @@ import optparse
 import raidpirlib as lib
 
 # Check the python version
-if sys.version_info[0] != 3 or sys.version_info[1] < 5:
-	print("Requires Python >= 3.5")
+if sys.version_info[0] != 3 or sys.version_info[1] < 7:
+	print("Requires Python >= 3.7")
 	sys.exit(1)
 
 # for unpacking messages
@@ -63,36 +63,167 @@ import threading
 # used to send messages to the mirrors
 import socket
 
-# to handle protocol requests
-import socketserver
+# to handle protocol requests, all connections are served by one event loop
+import asyncio
+
+# blocking work is handed to a fixed number of threads
+import concurrent.futures
 
 # to run in the background...
 import daemon
 
+# to reload the manifest on SIGHUP
+import signal
+
+# to check whether the manifest file changed
+import os
+
+# to find the mirrors that expire next
+import heapq
+
+# the supervisor of several vendor processes waits for their messages
+import selectors
+
+# holds the copy of the manifest that is sent, where memfd is not available
+import tempfile
+
+# to copy the manifest where sendfile can't
+import shutil
+
+# the copy of the manifest is parsed without reading it into memory
+import mmap
+
 # for logging purposes...
 import time
 import traceback
 
 _logfo = None
 
-def _log(stringtolog):
-	# helper function to log data
-	_logfo.write(str(time.time()) + " " + stringtolog + "\n")
-	_logfo.flush()
-
-_global_rawmanifestdata = None
-_global_rawmirrorlist = None
-
+# how often the log is flushed once it is written in the background (seconds)
+_logflushinterval = 0.1
+
+def _log(stringtolog, *args):
+	# helper function to log data. args are %-formatted into stringtolog, so
+	# callers don't build the string by concatenation
+	if args:
+		stringtolog = stringtolog % args
+	_logfo.write("%r %s\n" % (time.time(), stringtolog))
+
+# the constant replies are framed once, sending them is a single sendall
+_framed_mirrorinfotoolarge = session.framemessage("Error, mirrorinfo too large!")
+_framed_mirrorinfounpackerror = session.framemessage("Error cannot unpack mirrorinfo!")
+_framed_mirrorinfoinvalid = session.framemessage("Error, mirrorinfo has an invalid format.")
+_framed_mirrorinfowrongip = session.framemessage("Error, must provide mirrorinfo from the mirror's IP")
+_framed_ok = session.framemessage('OK')
+_framed_manifestupdate = session.framemessage('MANIFEST UPDATE')
+_framed_vendorhi = session.framemessage("VENDORHI!")
+_framed_invalidrequest = session.framemessage('Invalid request type')
+
+# (length header, file, length) of the private copy of the manifest that
+# GET MANIFEST sends with sendfile. Published as one tuple so the header
+# always matches the file.
+_global_manifest = None
+
+# the zstd level of the compressed mirror list. It is compressed once per
+# change, not per request
+_mirrorlistzstdlevel = 3
+
+def _compress_mirrorlist(rawmirrorlist):
+	# helper function that compresses the mirror list, if zstandard is installed
+	if lib.zstandard == None:
+		return None
+	return lib.zstandard.ZstdCompressor(level=_mirrorlistzstdlevel).compress(rawmirrorlist)
+
+# the encoded mirror list without any mirrors, packed once
+_emptymirrorlist = msgpack.packb([])
+_emptymirrorlist_capnp = lib.pack_mirrorlist_capnp(()) if lib.capnp_error == None else None
+_emptymirrorlist_zstd = _compress_mirrorlist(_emptymirrorlist)
+
+_global_rawmirrorlist = _emptymirrorlist
+# the same list in Cap'n Proto format, if the capnp module and schema load
+_global_rawmirrorlist_capnp = _emptymirrorlist_capnp
+# and compressed, if the zstandard module is installed
+_global_rawmirrorlist_zstd = _emptymirrorlist_zstd
+
+# a mirrorinfo is a small dict, anything bigger or deeper is rejected while
+# unpacking. The total size is already bounded by --maxmirrorinfo
+_mirrorinfounpacklimits = {'max_array_len':8, 'max_map_len':16, 'max_str_len':256, 'max_bin_len':0, 'max_ext_len':0}
+# the keys a mirror may advertise
+_mirrorinfokeys = frozenset(('ip', 'port'))
+
+# how many mirrors are notified of a manifest update at the same time, and
+# how long to wait for each of them (in seconds)
+_maxnotifyconnections = 32
+_notifytimeout = 2.0
+
+# the pid of the process that forked us, if --processes started several
+# vendor processes, and our socket to it. It passes SIGHUP and our messages
+# on to all of them.
+_supervisorpid = None
+_supervisorsocket = None
+# the first byte of a message tells what follows: mirrorinfo a mirror
+# advertised, or [pid, mtime, size] of the manifest a vendor process serves
+# after a reload
+_mirrorinfomessage = b'M'
+_manifestmessage = b'R'
+# pid -> (mtime, size) of the manifest the other vendor processes serve, and
+# the event that is set when one of them reports
+_peer_manifest_versions = {}
+_peer_manifest_event = None
+# how long a MANIFEST UPDATE waits for the other vendor processes to reload
+# before it notifies the mirrors anyway (in seconds)
+_reloadtimeout = 5.0
+# keeps the reloads started by SIGHUP until they are done
+_reloadtasks = set()
+# how often the supervisor checks if vendor processes exited (in seconds)
+_supervisorpollinterval = 1.0
+
+# (mtime, size) of the manifest file that _global_manifest was copied from
+_manifest_mtime = None
+
+# (ip, port) -> {'mirrorinfo':..., 'advertisetime':...}
 _global_mirrorinfodict = {}
 _global_mirrorinfolock = threading.Lock()
 
+# immutable copy of the mirrorinfos in _global_mirrorinfodict. Writers replace
+# it while holding the lock, readers use it without locking.
+_global_mirrorinfo_snapshot = ()
+
+# min-heap of (expirytime, index), one entry per advertisement. Entries of
+# mirrors that advertised again in the meantime are stale and skipped.
+_expiry_heap = []
+
 
 ########################### Mirrorlist manipulation ##########################
-def _check_for_expired_mirrorinfo():
-	# Private function to check to see if mirrors are expired...
+def _rebuild_rawmirrorlist():
+	# Private function that publishes the mirror list that is sent to the
+	# clients. The caller must hold _global_mirrorinfolock.
 
-	# I'll be updating this
+	# I'll be updating these
 	global _global_rawmirrorlist
+	global _global_rawmirrorlist_capnp
+	global _global_rawmirrorlist_zstd
+	global _global_mirrorinfo_snapshot
+
+	mirrorinfo_snapshot = tuple(entry['mirrorinfo'] for entry in _global_mirrorinfodict.values())
+
+	# and replace the globals. Handlers only read the references, so they get
+	# either the old or the new list
+	if not mirrorinfo_snapshot:
+		# all mirrors expired
+		_global_rawmirrorlist = _emptymirrorlist
+		_global_rawmirrorlist_capnp = _emptymirrorlist_capnp
+		_global_rawmirrorlist_zstd = _emptymirrorlist_zstd
+	else:
+		_global_rawmirrorlist = msgpack.packb(list(mirrorinfo_snapshot))
+		if lib.capnp_error == None:
+			_global_rawmirrorlist_capnp = lib.pack_mirrorlist_capnp(mirrorinfo_snapshot)
+		_global_rawmirrorlist_zstd = _compress_mirrorlist(_global_rawmirrorlist)
+	_global_mirrorinfo_snapshot = mirrorinfo_snapshot
+
+
+def _check_for_expired_mirrorinfo():
+	# Private function to check to see if mirrors are expired...
 
 	# No need to block and wait for this to happen if there are multiple of these
 	if _global_mirrorinfolock.acquire(False):
@@ -100,33 +231,50 @@ def _check_for_expired_mirrorinfo():
 		# always release the lock...
 		try:
 			now = time.time()
-			# walk through the mirrors and remove any that are over time...
-			for index in _global_mirrorinfodict:
+			removed = False
 
-				# if it's expired, remove the entry...
-				if now > _commandlineoptions.mirrorexpirytime + _global_mirrorinfodict[index]['advertisetime']:
-					del _global_mirrorinfodict[index]
-					_log("RAID-PIR Vendor Removing Mirror due to timeout: " + index)
+			# the loop may pop many entries, look these up only once
+			expiryheap = _expiry_heap
+			heappop = heapq.heappop
+			mirrorinfodict = _global_mirrorinfodict
+			mirrorexpirytime = _commandlineoptions.mirrorexpirytime
 
-			mirrorlist = []
-			# now let's rebuild the mirrorlist
-			for index in _global_mirrorinfodict:
-				mirrorlist.append(_global_mirrorinfodict[index]['mirrorinfo'])
+			# look only at the advertisements that are over time...
+			while expiryheap and expiryheap[0][0] < now:
+				expirytime, index = heappop(expiryheap)
 
-			# and replace the global
-			_global_rawmirrorlist = msgpack.packb(mirrorlist)
+				# if the mirror did not advertise again since, remove the entry...
+				mirrorentry = mirrorinfodict.get(index)
+				if mirrorentry != None and now > mirrorexpirytime + mirrorentry['advertisetime']:
+					del mirrorinfodict[index]
+					removed = True
+					_log("RAID-PIR Vendor Removing Mirror due to timeout: %s:%s", *index)
+
+			# now let's rebuild the mirrorlist, if it changed
+			if removed:
+				_rebuild_rawmirrorlist()
 
 		finally:
 			# always release
 			_global_mirrorinfolock.release()
 
 
+def _expire_mirrorinfo_periodically():
+	# Private function that runs in a background thread and removes expired
+	# mirrors, so clients never wait for that
+	interval = max(_commandlineoptions.mirrorexpirytime / 10, 0.1)
+
+	while True:
+		time.sleep(interval)
+		_check_for_expired_mirrorinfo()
+
+
 def _add_mirrorinfo_to_list(thismirrorinfo):
 	# Private function to add mirror information
-	_log("RAID-PIR Vendor _add_mirrorinfo_to_list " + str(thismirrorinfo))
+	_log("RAID-PIR Vendor _add_mirrorinfo_to_list %s", thismirrorinfo)
 
 	# add mirror information along with the time
-	index = thismirrorinfo['ip'] + ":" + str(thismirrorinfo['port'])
+	index = (thismirrorinfo['ip'], thismirrorinfo['port'])
 
 	# get the lock and add it to the dict
 	_global_mirrorinfolock.acquire()
@@ -134,160 +282,513 @@ def _add_mirrorinfo_to_list(thismirrorinfo):
 		# I get the time in here, in case I block for a noticible time waiting for
 		# the lock
 		now = time.time()
+
+		# a mirror that advertises itself again only refreshes its time
+		changed = index not in _global_mirrorinfodict or _global_mirrorinfodict[index]['mirrorinfo'] != thismirrorinfo
+
 		_global_mirrorinfodict[index] = {'mirrorinfo':thismirrorinfo, 'advertisetime':now}
+		heapq.heappush(_expiry_heap, (now + _commandlineoptions.mirrorexpirytime, index))
+
+		if changed:
+			_rebuild_rawmirrorlist()
 
 	finally:
 		_global_mirrorinfolock.release()
 
 
-######################### Serve RAID-PIR Vendor requests ########################
+def _load_manifest(manifestfilename):
+	# Private function that copies the manifest into an unnamed file and
+	# parses it from there. Returns the manifest dict, the tuple for
+	# _global_manifest and the (mtime, size) of the file. The manifest file
+	# itself may be rewritten while it is being sent, the copy never changes.
+	if hasattr(os, 'memfd_create'):
+		manifestfile = os.fdopen(os.memfd_create("raidpir-manifest"), 'w+b')
+	else:
+		manifestfile = tempfile.TemporaryFile()
+
+	with open(manifestfilename, 'rb') as manifestfo:
+		manifeststat = os.fstat(manifestfo.fileno())
+		_copy_file(manifestfo, manifestfile, manifeststat.st_size)
 
-class ThreadedVendorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-	allow_reuse_address = True
+	# the copy is parsed in place, the manifest is never read into a bytes
+	# object. (mapping the manifest file itself could fault if it is
+	# truncated while we parse it)
+	with mmap.mmap(manifestfile.fileno(), 0, prot=mmap.PROT_READ) as manifestmap:
+		manifestdict = lib.parse_manifest(manifestmap)
+		manifestlength = len(manifestmap)
 
+	manifestheader = manifestlength.to_bytes(session.lengthbytes, byteorder = 'big', signed=True)
+	return (manifestdict, (manifestheader, manifestfile, manifestlength), (manifeststat.st_mtime_ns, manifeststat.st_size))
 
-class ThreadedVendorRequestHandler(socketserver.BaseRequestHandler):
 
-	def handle(self):
+def _copy_file(sourcefo, destfo, length):
+	# Private function that copies a file in the kernel where it can
+	try:
+		copied = 0
+		while copied < length:
+			sent = os.sendfile(destfo.fileno(), sourcefo.fileno(), copied, length - copied)
+			if sent == 0:
+				break
+			copied += sent
 
-		# read the request from the socket...
-		requeststring = session.recvmessage(self.request)
+	except OSError:
+		# sendfile only writes to sockets here
+		sourcefo.seek(0)
+		destfo.seek(0)
+		destfo.truncate()
+		shutil.copyfileobj(sourcefo, destfo)
+		destfo.flush()
 
-		# for logging purposes, get the remote info
-		remoteip, remoteport = self.request.getpeername()
 
-		# if it's a request for a XORBLOCK
-		if requeststring == b'GET MANIFEST':
-			print("GET MANIFEST")
+def _refresh_manifest_if_changed():
+	# Private function that reloads the cached manifest if the file changed.
+	# Reading it may block, so it runs on a worker thread.
 
-			rawmanifestdata = open(_commandlineoptions.manifestfilename, 'rb').read()
-			_global_rawmanifestdata = rawmanifestdata
+	global _global_manifest
+	global _manifest_mtime
 
-			session.sendmessage(self.request, _global_rawmanifestdata)
-			_log("RAID-PIR Vendor " + remoteip + " " + str(remoteport) + " manifest request")
+	try:
+		manifeststat = os.stat(_commandlineoptions.manifestfilename)
 
-			# done!
+		if (manifeststat.st_mtime_ns, manifeststat.st_size) == _manifest_mtime:
 			return
 
-		elif requeststring == b'MANIFEST UPDATE':
-			print('MANIFEST UPDATE')
+		# only serve manifests that can be parsed
+		(manifestdict, manifest, mtime) = _load_manifest(_commandlineoptions.manifestfilename)
 
-			rawmanifestdata = open(_commandlineoptions.manifestfilename, 'rb').read()
-			_global_rawmanifestdata = rawmanifestdata
+	except (OSError, TypeError, ValueError) as e:
+		# keep serving the manifest we have
+		_log("RAID-PIR Vendor cannot reload manifest: %s", e)
+		return
 
-			# get a copy of the mirrorlist
-			mirrorlist = list()
-			_global_mirrorinfolock.acquire()
-			try:
-				for mirror in _global_mirrorinfodict:
-					mirrorlist.append(
-						_global_mirrorinfodict[mirror]['mirrorinfo'])
-			finally:
-				_global_mirrorinfolock.release()
-
-			for mirror in mirrorlist:
-				sock = None
-				try:
-					# Connect to server and send data
-					sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-					sock.connect((mirror['ip'], mirror['port']))
-					session.sendmessage(sock, 'MANIFEST UPDATE')
-				except:
-					print("Could not connect to mirror", mirror)
-					pass
-				finally:
-					sock.close()
-
-		elif requeststring == b'GET MIRRORLIST':
-			# let's try to clean up the list.   If we are busy with another attempt
-			# to do this, the latter will be a NOOP
-			_check_for_expired_mirrorinfo()
-
-			# reply with the mirror list
-			session.sendmessage(self.request, _global_rawmirrorlist)
-			_log("RAID-PIR Vendor " + remoteip + " " + str(remoteport) + " mirrorlist request")
-
-			# done!
+	# replacing the reference is atomic, handlers see either the old or the
+	# new one. The old copy is closed when the last handler is done with it
+	_global_manifest = manifest
+	_manifest_mtime = mtime
+	_log("RAID-PIR Vendor loaded manifest %s", _commandlineoptions.manifestfilename)
+
+
+async def _notify_mirror(mirror, connectionslots):
+	# Private function that tells a mirror to fetch the new manifest
+	async with connectionslots:
+		try:
+			# Connect to server and send data
+			reader, writer = await asyncio.wait_for(asyncio.open_connection(mirror['ip'], mirror['port']), _notifytimeout)
+		except (OSError, asyncio.TimeoutError):
+			print("Could not connect to mirror", mirror)
 			return
 
-		elif requeststring.startswith(b'MIRRORADVERTISE'):
-			# This is a mirror telling us it's ready to serve clients.
+		try:
+			writer.write(_framed_manifestupdate)
+			await asyncio.wait_for(writer.drain(), _notifytimeout)
+		except (OSError, asyncio.TimeoutError):
+			print("Could not notify mirror", mirror)
+		finally:
+			writer.close()
 
-			_log("RAID-PIR Vendor " + remoteip + " " + str(remoteport) + " mirror advertise")
 
-			mirrorrawdata = requeststring[len(b'MIRRORADVERTISE'):]
+######################### Serve RAID-PIR Vendor requests ########################
 
-			# handle the case where the mirror provides data that is larger than
-			# we want to serve
-			if len(mirrorrawdata) > _commandlineoptions.maxmirrorinfo:
-				session.sendmessage(self.request, "Error, mirrorinfo too large!")
-				_log("RAID-PIR Vendor " + remoteip + " " + str(remoteport) + " mirrorinfo too large: " + str(len(mirrorrawdata)))
-				return
+async def _read_request(reader):
+	# Private function that reads one length-prefixed message. A connection
+	# that is closed before a message arrives reads as an empty message.
+	try:
+		header = await reader.readexactly(session.lengthbytes)
+	except asyncio.IncompleteReadError:
+		return b''
 
-			# Let's sanity check the data...
-			# can we unpack it?
-			try:
-				mirrorinfodict = msgpack.unpackb(mirrorrawdata, raw=False)
-			except (TypeError, ValueError) as e:
-				session.sendmessage(self.request, "Error cannot unpack mirrorinfo!")
-				_log("RAID-PIR Vendor " + remoteip + " " + str(remoteport) + " cannot unpack mirrorinfo!" + str(e))
-				return
-
-			# is it a dictionary and does it have the required keys?
-			if type(mirrorinfodict) != dict or 'ip' not in mirrorinfodict or 'port' not in mirrorinfodict:
-				session.sendmessage(self.request, "Error, mirrorinfo has an invalid format.")
-				_log("RAID-PIR Vendor " + remoteip + " " + str(remoteport) + " mirrorinfo has an invalid format")
-				return
-
-
-			#is the mirror to add coming from the same ip?
-			if _commandlineoptions.checkmirrorip:
-				if mirrorinfodict['ip'] != remoteip:
-					session.sendmessage(self.request, "Error, must provide mirrorinfo from the mirror's IP")
-					_log("RAID-PIR Vendor "+remoteip+" "+str(remoteport)+" mirrorinfo provided from the wrong IP")
-					return
-
-			# add the information to the mirrorlist
-			_add_mirrorinfo_to_list(mirrorinfodict)
-
-			# and notify the user
-			session.sendmessage(self.request, 'OK')
-			_log("RAID-PIR Vendor " + remoteip + " " + str(remoteport) + " mirrorinfo update " + str(len(mirrorrawdata)))
-
-			# done!
+	messagesize = int.from_bytes(header, byteorder = 'big', signed=True)
+
+	if messagesize < 0:
+		raise ValueError("Bad message size")
+
+	return await reader.readexactly(messagesize)
+
+
+def _send_message(writer, data):
+	# Private function that frames a message without copying the data
+	writer.writelines([len(data).to_bytes(session.lengthbytes, byteorder = 'big', signed=True), data])
+
+
+def _set_cork(writer, cork):
+	# Private function that holds back (1) or releases (0) partial segments
+	if hasattr(socket, 'TCP_CORK'):
+		writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, cork)
+
+
+async def _handle_connection(reader, writer):
+	# serves a single request of a client or mirror, then closes the connection
+	try:
+		await _handle_request(reader, writer)
+		await writer.drain()
+
+	except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+		# the peer went away or sent garbage, there's nobody to reply to
+		_log("RAID-PIR Vendor connection error: %s", e)
+
+	finally:
+		writer.close()
+
+
+async def _handle_request(reader, writer):
+
+	# read the request from the socket...
+	requeststring = await _read_request(reader)
+
+	# for logging purposes, get the remote info
+	remoteip, remoteport = writer.get_extra_info('peername')[:2]
+
+	# one lookup finds the handler of the fixed requests...
+	requesthandler = _request_handlers.get(requeststring)
+	if requesthandler != None:
+		await requesthandler(writer, remoteip, remoteport)
+
+	# ...the advertisement carries data after its prefix...
+	elif requeststring.startswith(b'MIRRORADVERTISE'):
+		await _handle_mirroradvertise(writer, remoteip, remoteport, requeststring[len(b'MIRRORADVERTISE'):])
+
+	else:
+		# we don't know what this is!   Log and tell the requestor
+		_log("RAID-PIR Vendor %s %s Invalid request type starts: %r", remoteip, remoteport, requeststring[:16])
+
+		writer.write(_framed_invalidrequest)
+
+
+async def _handle_getmanifest(writer, remoteip, remoteport):
+	print("GET MANIFEST")
+
+	(manifestheader, manifestfile, manifestlength) = _global_manifest
+
+	# cork the connection, so the header goes out with the start of the body
+	_set_cork(writer, 1)
+	writer.write(manifestheader)
+
+	try:
+		# the kernel copies the manifest from the page cache to the socket
+		await asyncio.get_running_loop().sendfile(writer.transport, manifestfile, 0, manifestlength, fallback=False)
+	except asyncio.SendfileNotAvailableError:
+		# the file position is shared by all handlers, so read with an offset
+		writer.write(os.pread(manifestfile.fileno(), manifestlength, 0))
+
+	_set_cork(writer, 0)
+	_log("RAID-PIR Vendor %s %s manifest request", remoteip, remoteport)
+
+
+def _handle_sighup():
+	# Private function, the operator (or the supervisor) asks for the manifest
+	# to be reloaded. This runs on the event loop.
+	task = asyncio.ensure_future(_reload_manifest())
+	_reloadtasks.add(task)
+	task.add_done_callback(_reloadtasks.discard)
+
+
+async def _reload_manifest():
+	# Private function that reloads the manifest on a worker thread and tells
+	# the other vendor processes which one we serve now.
+	await asyncio.get_running_loop().run_in_executor(None, _refresh_manifest_if_changed)
+
+	if _supervisorsocket != None:
+		try:
+			_supervisorsocket.send(_manifestmessage + msgpack.packb([os.getpid(), _manifest_mtime[0], _manifest_mtime[1]]))
+		except OSError:
+			pass
+
+
+async def _wait_for_peer_manifests(manifestversion):
+	# Private function that waits until all other vendor processes serve the
+	# manifest with this (mtime, size), or until _reloadtimeout passed.
+	loop = asyncio.get_running_loop()
+	deadline = loop.time() + _reloadtimeout
+
+	while list(_peer_manifest_versions.values()).count(manifestversion) < _commandlineoptions.processes - 1:
+		_peer_manifest_event.clear()
+
+		try:
+			await asyncio.wait_for(_peer_manifest_event.wait(), deadline - loop.time())
+		except asyncio.TimeoutError:
+			_log("RAID-PIR Vendor not all vendor processes reloaded the manifest")
+			return
+
+
+async def _handle_manifestupdate(writer, remoteip, remoteport):
+	print('MANIFEST UPDATE')
+
+	# the mirrors will ask for the new manifest. Reading it may block, so it
+	# is done on a worker thread
+	await asyncio.get_running_loop().run_in_executor(None, _refresh_manifest_if_changed)
+
+	# the supervisor has the other vendor processes reload it as well. The
+	# mirrors are only notified when all of them serve the new one
+	if _supervisorpid != None:
+		os.kill(_supervisorpid, signal.SIGHUP)
+		await _wait_for_peer_manifests(_manifest_mtime)
+
+	# the snapshot of the mirrorlist can't change under us
+	mirrorlist = _global_mirrorinfo_snapshot
+
+	# notify all mirrors at the same time, a slow one doesn't hold up the others
+	connectionslots = asyncio.Semaphore(_maxnotifyconnections)
+	await asyncio.gather(*[_notify_mirror(mirror, connectionslots) for mirror in mirrorlist])
+
+
+async def _handle_getmirrorlist(writer, remoteip, remoteport):
+	# reply with the mirror list. It is kept up to date when mirrors are
+	# added or expire
+	_send_message(writer, _global_rawmirrorlist)
+	_log("RAID-PIR Vendor %s %s mirrorlist request", remoteip, remoteport)
+
+
+async def _handle_getmirrorlistcapnp(writer, remoteip, remoteport):
+	# the same list, for clients that read Cap'n Proto
+	_send_message(writer, _global_rawmirrorlist_capnp)
+	_log("RAID-PIR Vendor %s %s capnp mirrorlist request", remoteip, remoteport)
+
+
+async def _handle_getmirrorlistzstd(writer, remoteip, remoteport):
+	# the msgpack list, compressed when it was built
+	_send_message(writer, _global_rawmirrorlist_zstd)
+	_log("RAID-PIR Vendor %s %s zstd mirrorlist request", remoteip, remoteport)
+
+
+async def _handle_hello(writer, remoteip, remoteport):
+	# send a reply.
+	writer.write(_framed_vendorhi)
+	_log("RAID-PIR Vendor %s %s VENDORHI!", remoteip, remoteport)
+
+
+def _check_mirrorinfo_format(mirrorinfodict):
+	# Private function, tells if unpacked mirrorinfo can go in the mirror list
+
+	# is it a dictionary and does it have the required keys?
+	if type(mirrorinfodict) != dict or 'ip' not in mirrorinfodict or 'port' not in mirrorinfodict or not mirrorinfodict.keys() <= _mirrorinfokeys:
+		return False
+
+	# the ip and port must fit the mirror list formats
+	return type(mirrorinfodict['ip']) == str and type(mirrorinfodict['port']) == int and 0 < mirrorinfodict['port'] <= 65535
+
+
+async def _handle_mirroradvertise(writer, remoteip, remoteport, mirrorrawdata):
+	# This is a mirror telling us it's ready to serve clients.
+
+	_log("RAID-PIR Vendor %s %s mirror advertise", remoteip, remoteport)
+
+	# handle the case where the mirror provides data that is larger than
+	# we want to serve
+	if len(mirrorrawdata) > _commandlineoptions.maxmirrorinfo:
+		writer.write(_framed_mirrorinfotoolarge)
+		_log("RAID-PIR Vendor %s %s mirrorinfo too large: %d", remoteip, remoteport, len(mirrorrawdata))
+		return
+
+	# Let's sanity check the data...
+	# can we unpack it?
+	try:
+		mirrorinfodict = msgpack.unpackb(mirrorrawdata, raw=False, **_mirrorinfounpacklimits)
+	except (TypeError, ValueError) as e:
+		writer.write(_framed_mirrorinfounpackerror)
+		_log("RAID-PIR Vendor %s %s cannot unpack mirrorinfo! %s", remoteip, remoteport, e)
+		return
+
+	# is it a dictionary with the required keys?
+	if not _check_mirrorinfo_format(mirrorinfodict):
+		writer.write(_framed_mirrorinfoinvalid)
+		_log("RAID-PIR Vendor %s %s mirrorinfo has an invalid format", remoteip, remoteport)
+		return
+
+
+	#is the mirror to add coming from the same ip?
+	if _commandlineoptions.checkmirrorip:
+		if mirrorinfodict['ip'] != remoteip:
+			writer.write(_framed_mirrorinfowrongip)
+			_log("RAID-PIR Vendor %s %s mirrorinfo provided from the wrong IP", remoteip, remoteport)
 			return
 
-		# add HELLO
-		elif requeststring == b'HELLO':
-			# send a reply.
-			session.sendmessage(self.request, "VENDORHI!")
-			_log("RAID-PIR Vendor " + remoteip + " " + str(remoteport) + " VENDORHI!")
+	# add the information to the mirrorlist
+	_add_mirrorinfo_to_list(mirrorinfodict)
 
-			# done!
+	# and tell the other vendor processes
+	if _supervisorsocket != None:
+		try:
+			_supervisorsocket.send(_mirrorinfomessage + mirrorrawdata)
+		except OSError:
+			pass
+
+	# and notify the user
+	writer.write(_framed_ok)
+	_log("RAID-PIR Vendor %s %s mirrorinfo update %d", remoteip, remoteport, len(mirrorrawdata))
+
+
+# the requests without arguments and their handlers
+_request_handlers = {
+	b'GET MANIFEST': _handle_getmanifest,
+	b'MANIFEST UPDATE': _handle_manifestupdate,
+	b'GET MIRRORLIST': _handle_getmirrorlist,
+	b'HELLO': _handle_hello,
+}
+
+# only offered if we can build them
+if lib.capnp_error == None:
+	_request_handlers[b'GET MIRRORLIST CAPNP'] = _handle_getmirrorlistcapnp
+if lib.zstandard != None:
+	_request_handlers[b'GET MIRRORLIST ZSTD'] = _handle_getmirrorlistzstd
+
+
+async def _serve_vendor_requests(ip, port):
+	# runs the event loop that serves all connections
+
+	global _peer_manifest_event
+
+	# blocking work (reading the manifest) is handed to these threads
+	asyncio.get_running_loop().set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=_commandlineoptions.maxthreads, thread_name_prefix="VendorWorker"))
+
+	# the operator can ask for the manifest to be reloaded. A SIGHUP that
+	# came in while we were starting is handled now
+	if hasattr(signal, 'SIGHUP'):
+		asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, _handle_sighup)
+		signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGHUP])
+
+	# mirrors that advertised to the other vendor processes, and their reloads
+	if _supervisorsocket != None:
+		_peer_manifest_event = asyncio.Event()
+		asyncio.get_running_loop().add_reader(_supervisorsocket.fileno(), _receive_relayed_messages)
+
+	# with --processes several vendor processes listen on the same port, the
+	# kernel spreads the connections over them. A single vendor doesn't share
+	# its port, a second one started by mistake fails to bind. asyncio sets
+	# TCP_NODELAY on the accepted connections, the replies are tiny.
+	reuseport = _commandlineoptions.processes > 1
+
+	vendorserver = await asyncio.start_server(_handle_connection, ip, port, reuse_address=True, reuse_port=reuseport)
+
+	async with vendorserver:
+		await vendorserver.serve_forever()
+
+
+def _fork_vendor_processes(processes):
+	# Private function that forks the vendor processes. Only they return from
+	# here. This process stays behind as their supervisor: it relays their
+	# messages between them, passes SIGHUP and SIGTERM on to them and
+	# exits when all of them are gone.
+
+	global _supervisorpid
+	global _supervisorsocket
+
+	childpids = []
+	vendorsockets = []
+	for _ in range(processes):
+		vendorsocket, supervisorsocket = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+		pid = os.fork()
+		if pid == 0:
+			vendorsocket.close()
+			for othersocket in vendorsockets:
+				othersocket.close()
+			supervisorsocket.setblocking(False)
+			_supervisorpid = os.getppid()
+			_supervisorsocket = supervisorsocket
 			return
 
-		else:
-			# we don't know what this is!   Log and tell the requestor
-			_log("RAID-PIR Vendor " + remoteip + " " + str(remoteport) + " Invalid request type starts:'" + requeststring[:5] + "'")
+		supervisorsocket.close()
+		# a stuck vendor process must not hold up the others
+		vendorsocket.setblocking(False)
+		childpids.append(pid)
+		vendorsockets.append(vendorsocket)
 
-			session.sendmessage(self.request, 'Invalid request type')
+	def _forward_signal(signum, frame):
+		for pid in childpids:
+			try:
+				os.kill(pid, signum)
+			except ProcessLookupError:
+				pass
+
+	signal.signal(signal.SIGHUP, _forward_signal)
+	signal.signal(signal.SIGTERM, _forward_signal)
+	# Ctrl+C reaches the vendor processes directly
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGHUP])
+
+	sys.exit(_relay_messages(childpids, vendorsockets))
+
+
+def _relay_messages(childpids, vendorsockets):
+	# Private function that passes the messages of one vendor process on to
+	# all others, until all of them exited. Returns the exit code.
+	selector = selectors.DefaultSelector()
+	for vendorsocket in vendorsockets:
+		selector.register(vendorsocket, selectors.EVENT_READ)
+
+	remainingpids = set(childpids)
+	failed = False
+	while remainingpids:
+		for key, events in selector.select(_supervisorpollinterval):
+			try:
+				rawdata = key.fileobj.recv(_commandlineoptions.maxmirrorinfo + 1)
+			except OSError:
+				continue
+
+			for vendorsocket in vendorsockets:
+				if vendorsocket is not key.fileobj:
+					try:
+						vendorsocket.send(rawdata)
+					except OSError:
+						# gone or not keeping up. It hears from the mirror next time
+						pass
+
+		# collect the vendor processes that exited
+		while remainingpids:
+			pid, status = os.waitpid(-1, os.WNOHANG)
+			if pid == 0:
+				break
+			remainingpids.discard(pid)
+			# being stopped by a signal is how they are meant to end
+			failed = failed or (os.WIFEXITED(status) and os.WEXITSTATUS(status) != 0)
+
+	return 1 if failed else 0
+
+
+def _receive_relayed_messages():
+	# Private function that handles the messages of the other vendor
+	# processes: it adds the mirrorinfo they received (it was checked there
+	# already) and notes which manifest they serve. A bad datagram must not
+	# disturb the event loop
+	while True:
+		try:
+			rawdata = _supervisorsocket.recv(_commandlineoptions.maxmirrorinfo + 1)
+		except BlockingIOError:
+			return
+		except OSError as e:
+			_log("RAID-PIR Vendor cannot receive relayed message! %s", e)
 			return
 
+		if len(rawdata) == 0:
+			continue
+
+		try:
+			message = msgpack.unpackb(rawdata[1:], raw=False, **_mirrorinfounpacklimits)
+		except (TypeError, ValueError) as e:
+			_log("RAID-PIR Vendor cannot unpack relayed message! %s", e)
+			continue
+
+		if rawdata[:1] == _mirrorinfomessage and _check_mirrorinfo_format(message):
+			_add_mirrorinfo_to_list(message)
+
+		elif rawdata[:1] == _manifestmessage and type(message) == list and len(message) == 3:
+			_peer_manifest_versions[message[0]] = (message[1], message[2])
+			_peer_manifest_event.set()
+
+		else:
+			_log("RAID-PIR Vendor relayed message has an invalid format")
+
 
 def start_vendor_service(manifestdict, ip, port):
 
 	# this should be done before we are called
-	assert _global_rawmanifestdata != None
-
-	# create the handler / server
-	vendorserver = ThreadedVendorServer((ip, port), ThreadedVendorRequestHandler)
+	assert _global_manifest != None
 
-	_log('vendor servers started at' + str(ip) + ':' + str(port))
+	_log("vendor servers started at %s:%s", ip, port)
 	print("Vendor Server started at", ip, ":", port)
 	print("Manifest contains", len(manifestdict['fileinfolist']), "files in", manifestdict['blockcount'], "blocks of size", manifestdict['blocksize'], "B")
 
 	# and serve forever!
-	vendorserver.serve_forever()
+	asyncio.run(_serve_vendor_requests(ip, port))
 
 
 ########################### Option parsing and main ###########################
@@ -350,6 +851,12 @@ def parse_options():
 	parser.add_option("", "--port", dest="port", type="int", metavar="portnum",
 				default=None, help="Run the vendor on the following port (default: from manifest)")
 
+	parser.add_option("", "--maxthreads", dest="maxthreads", type="int", metavar="number",
+				default=2 * (os.cpu_count() or 1), help="The number of threads for blocking work like reloading the manifest (default: twice the number of CPUs)")
+
+	parser.add_option("", "--processes", dest="processes", type="int", metavar="number",
+				default=1, help="The number of vendor processes that share the port (default 1)")
+
 	# let's parse the args
 	(_commandlineoptions, remainingargs) = parser.parse_args()
 
@@ -358,6 +865,18 @@ def parse_options():
 		print("Max mirror info size must be positive")
 		sys.exit(1)
 
+	if _commandlineoptions.maxthreads <= 0:
+		print("Max threads must be positive")
+		sys.exit(1)
+
+	if _commandlineoptions.processes <= 0:
+		print("Number of processes must be positive")
+		sys.exit(1)
+
+	if _commandlineoptions.processes > 1 and not (hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')):
+		print("Several vendor processes require fork and SO_REUSEPORT")
+		sys.exit(1)
+
 	if remainingargs:
 		print("Unknown options", remainingargs)
 		sys.exit(1)
@@ -367,18 +886,20 @@ def parse_options():
 
 
 def main():
-	global _global_rawmanifestdata
-	global _global_rawmirrorlist
-
-	# read in the manifest file
-	rawmanifestdata = open(_commandlineoptions.manifestfilename, 'rb').read()
+	global _logfo
+	global _global_manifest
+	global _manifest_mtime
 
-	# an ugly hack, but Python's request handlers don't have an easy way to thread to handle it pass arguments
-	_global_rawmanifestdata = rawmanifestdata
-	_global_rawmirrorlist = msgpack.packb([])
+	# SIGHUP (reload the manifest) would end the process until the event loop
+	# handles it, so it is held back until then. The vendor processes we fork
+	# and the threads we start inherit this
+	if hasattr(signal, 'SIGHUP'):
+		signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGHUP])
 
-	# I do this just for the sanity / corruption check
-	manifestdict = lib.parse_manifest(rawmanifestdata)
+	# read in the manifest file (this is also the sanity / corruption check).
+	# A copy is kept and only replaced when the file changed
+	# (see _refresh_manifest_if_changed)
+	(manifestdict, _global_manifest, _manifest_mtime) = _load_manifest(_commandlineoptions.manifestfilename)
 
 
 	# vendor ip
@@ -400,6 +921,20 @@ def main():
 	if _commandlineoptions.daemonize:
 		daemon.daemonize()
 
+	# the same goes for forking the vendor processes. Each binds its own socket
+	# to the port with SO_REUSEPORT, the kernel spreads the connections
+	if _commandlineoptions.processes > 1:
+		# or the buffered log lines would be written by every process
+		_logfo.flush()
+		_fork_vendor_processes(_commandlineoptions.processes)
+
+	# from now on, the log is written by a background thread (threads must not
+	# be started before detaching)
+	_logfo = lib.QueuedWriter(_logfo, _logflushinterval)
+
+	# expired mirrors are removed in the background
+	threading.Thread(target=_expire_mirrorinfo_periodically, name="Mirror expiry", daemon=True).start()
+
 	# we're now ready to handle clients!
 	_log('ready to start servers!')
 
@@ -418,4 +953,6 @@ if __name__ == '__main__':
 		print((str(type(e)) + " " + str(e)))
 		# this mess prints a not-so-nice traceback, but it does contain all relevant info
 		_log(str(traceback.format_tb(sys.exc_info()[2])))
+		# write out what is still queued
+		_logfo.close()
 		sys.exit(1)
@@ -22,8 +22,20 @@ import os
 # only need ceil
 import math
 
+# to walk through the pieces of a file
+import itertools
+
+# to read files while copying them into a database
+import mmap
+
 import socket
 
+# runs the writes of QueuedWriter
+import threading
+
+# hands writes to a background thread
+import queue
+
 # use this to turn the stream abstraction into a message abstraction...
 import session
 
@@ -42,8 +54,58 @@ if sys.version_info[0] != 3 or sys.version_info[1] < 5:
 
 import hashlib
 
-from Crypto.Cipher import AES
-from Crypto.Util import Counter
+try:
+	# for fast XOR of query strings and answers
+	import numpy
+except ImportError:
+	print("Requires numpy module (http://www.numpy.org/)")
+	sys.exit(1)
+
+try:
+	# optional, for the (much faster) blake3 hash algorithm
+	import blake3
+except ImportError:
+	blake3 = None
+
+try:
+	# optional, for the Cap'n Proto mirror list (GET MIRRORLIST CAPNP)
+	import capnp
+except ImportError:
+	capnp = None
+
+# why the Cap'n Proto mirror list can't be used (None: it can). A missing or
+# broken schema must not stop the import, it only matters when the format is
+# used.
+_raidpir_capnp = None
+if capnp == None:
+	capnp_error = "Requires the capnp module (https://capnproto.github.io/pycapnp/)"
+else:
+	try:
+		_raidpir_capnp = capnp.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), "raidpir.capnp"))
+		capnp_error = None
+	except Exception as e:
+		capnp_error = "Can't load the Cap'n Proto schema raidpir.capnp: " + str(e)
+
+try:
+	# optional, for the compressed mirror list (GET MIRRORLIST ZSTD)
+	import zstandard
+except ImportError:
+	zstandard = None
+
+try:
+	# AES-CTR from OpenSSL (uses AES-NI), expands the seeds of the -R mode
+	from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+	from cryptography.hazmat.backends import default_backend
+except ImportError:
+	Cipher = None
+
+if Cipher == None:
+	try:
+		from Crypto.Cipher import AES
+		from Crypto.Util import Counter
+	except ImportError:
+		print("Requires the cryptography module (https://cryptography.io/) or PyCrypto")
+		sys.exit(1)
 
 import time
 _timer = time.perf_counter
@@ -155,21 +217,21 @@ def _validate_manifest(manifest):
 	# this to fail later?   Can the version be used as a proxy check for this?
 
 
-_supported_hashalgorithms = ['md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512']
+_supported_hashalgorithms = ['md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512', 'blake3']
 
 _supported_hashencodings = ['hex', 'raw']
 
-def find_hash(contents, algorithm):
-	"""Helper function for hashing"""
+# how much of a file find_file_hash reads at once (if it cannot use file_digest)
+_hashreadsize = 1024 * 1024
 
-	# first, if it's a noop, do nothing. For testing and debugging only.
-	if algorithm == 'noop' or algorithm == "none" or algorithm == None:
-		return ''
+def _split_hashalgorithm(algorithm):
+	"""private helper, splits and checks an algorithm name like "sha256-raw" """
 
 	# accept things like: "sha1", "sha256-raw", etc.
 	# before the '-' is one of the types known to hashlib.   After is
-
-	# hashencoding = 'hex'
+	# the encoding of the digest
+	hashalgorithmname = algorithm
+	hashencoding = 'hex'
 	if '-' in algorithm:
 		# yes, this will raise an exception in some cases...
 		hashalgorithmname, hashencoding = algorithm.split('-')
@@ -181,11 +243,36 @@ def find_hash(contents, algorithm):
 	if hashencoding not in _supported_hashencodings:
 		raise TypeError("Do not understand hash encoding: '" + algorithm + "'")
 
+	return hashalgorithmname, hashencoding
+
+
+def new_hash(algorithm):
+	"""Helper function that returns a hash object to feed data in pieces.
+	None is returned for 'noop', see hash_digest."""
+
+	# first, if it's a noop, do nothing. For testing and debugging only.
+	if algorithm == 'noop' or algorithm == "none" or algorithm == None:
+		return None
+
+	hashalgorithmname, hashencoding = _split_hashalgorithm(algorithm)
+
 	if hashalgorithmname == 'sha256':
-		hashobj = hashlib.sha256(contents)
+		return hashlib.sha256()
+	elif hashalgorithmname == 'blake3':
+		if blake3 == None:
+			raise TypeError("Hash algorithm '" + algorithm + "' requires the blake3 module (https://pypi.org/project/blake3/)")
+		return blake3.blake3()
 	else:
-		hashobj = hashlib.new(hashalgorithmname)
-		hashobj.update(contents)
+		return hashlib.new(hashalgorithmname)
+
+
+def hash_digest(hashobj, algorithm):
+	"""Helper function that returns the digest of a hash object from new_hash"""
+
+	if hashobj == None:
+		return ''
+
+	hashalgorithmname, hashencoding = _split_hashalgorithm(algorithm)
 
 	if hashencoding == 'raw':
 		return hashobj.digest()
@@ -195,6 +282,34 @@ def find_hash(contents, algorithm):
 		raise Exception("Internal Error! Unknown hashencoding '" + hashencoding + "'")
 
 
+def find_hash(contents, algorithm):
+	"""Helper function for hashing"""
+
+	hashobj = new_hash(algorithm)
+
+	if hashobj != None:
+		hashobj.update(contents)
+
+	return hash_digest(hashobj, algorithm)
+
+
+def find_file_hash(filename, algorithm):
+	"""Helper function for hashing a file without reading it into memory"""
+
+	hashobj = new_hash(algorithm)
+
+	if hashobj != None:
+		with open(filename, 'rb') as fileobj:
+			if hasattr(hashlib, 'file_digest'):
+				# Python >= 3.11 hashes straight from the file's buffer
+				hashlib.file_digest(fileobj, lambda: hashobj)
+			else:
+				for data in iter(lambda: fileobj.read(_hashreadsize), b''):
+					hashobj.update(data)
+
+	return hash_digest(hashobj, algorithm)
+
+
 def transmit_mirrorinfo(mirrorinfo, vendorlocation, defaultvendorport=62293):
 	"""
 	<Purpose>
@@ -329,7 +444,55 @@ def request_xorblock_chunked_rng_parallel(socket, chunks):
 	session.sendmessage(socket, b"M" + msgpack.packb(chunks, use_bin_type=True))
 
 
-def retrieve_mirrorinfolist(vendorlocation, defaultvendorport=62293):
+# message prefixes of the chunked request types, see request_xorblock_chunked*
+_chunked_request_prefixes = {0: b"C", 1: b"R", 2: b"M"}
+
+def pack_xorrequest(xorrequesttuple):
+	"""
+	<Purpose>
+		Builds the message that requests a xorblock from a mirror, without
+		sending it.
+
+	<Arguments>
+		xorrequesttuple: a request tuple as returned by get_next_xorrequest of an
+		XORRequestor. Tuples with three entries carry a plain bitstring, chunked
+		requests carry the chunks and the request type (0: chunks only,
+		1: chunks and seed expansion, 2: chunks, seed expansion and parallel)
+
+	<Exceptions>
+		KeyError if the request type is unknown
+
+	<Returns>
+		The (unframed) message as bytes
+	"""
+
+	return b''.join(pack_xorrequest_buffers(xorrequesttuple))
+
+
+def pack_xorrequest_buffers(xorrequesttuple):
+	"""
+	<Purpose>
+		Like pack_xorrequest, but returns the message as a list of buffers so
+		the (possibly large) bitstring is not copied before it is sent.
+
+	<Arguments>
+		xorrequesttuple: a request tuple as returned by get_next_xorrequest of an
+		XORRequestor.
+
+	<Exceptions>
+		KeyError if the request type is unknown
+
+	<Returns>
+		The (unframed) message as a list of bytes-like objects
+	"""
+
+	if len(xorrequesttuple) == 3:
+		return [b"X", xorrequesttuple[2]]
+
+	return [_chunked_request_prefixes[xorrequesttuple[3]], msgpack.packb(xorrequesttuple[2], use_bin_type=True)]
+
+
+def retrieve_mirrorinfolist(vendorlocation, defaultvendorport=62293, usecapnp=False, usezstd=False):
 	"""
 	<Purpose>
 		Retrieves the mirrorinfolist from a vendor.
@@ -341,6 +504,13 @@ def retrieve_mirrorinfolist(vendorlocation, defaultvendorport=62293):
 		defaultvendorport: the port to use if the vendorlocation does not include
 											 one.
 
+		usecapnp: ask for the mirror list in Cap'n Proto format instead of msgpack.
+							Requires the capnp module and the schema here and
+							at the vendor.
+
+		usezstd: ask for the msgpack mirror list compressed with zstd.
+						 Requires the zstandard module here and at the vendor.
+
 	<Exceptions>
 		TypeError if the vendorlocation is the wrong type or malformed.
 
@@ -355,9 +525,30 @@ def retrieve_mirrorinfolist(vendorlocation, defaultvendorport=62293):
 	<Returns>
 		A list of mirror information dictionaries.
 	"""
-	rawmirrordata = _remote_query_helper(vendorlocation, b"GET MIRRORLIST", defaultvendorport)
+	if usecapnp:
+		if capnp_error != None:
+			raise ImportError(capnp_error)
+
+		rawmirrordata = _remote_query_helper(vendorlocation, b"GET MIRRORLIST CAPNP", defaultvendorport)
+		if rawmirrordata == b'Invalid request type':
+			raise ValueError("The vendor cannot send a Cap'n Proto mirror list")
+
+		mirrorinfolist = unpack_mirrorlist_capnp(rawmirrordata)
+
+	elif usezstd:
+		if zstandard == None:
+			raise ImportError("Requires the zstandard module (https://pypi.org/project/zstandard/)")
 
-	mirrorinfolist = msgpack.unpackb(rawmirrordata, raw=False)
+		rawmirrordata = _remote_query_helper(vendorlocation, b"GET MIRRORLIST ZSTD", defaultvendorport)
+		if rawmirrordata == b'Invalid request type':
+			raise ValueError("The vendor cannot send a compressed mirror list")
+
+		mirrorinfolist = msgpack.unpackb(zstandard.ZstdDecompressor().decompress(rawmirrordata), raw=False)
+
+	else:
+		rawmirrordata = _remote_query_helper(vendorlocation, b"GET MIRRORLIST", defaultvendorport)
+
+		mirrorinfolist = msgpack.unpackb(rawmirrordata, raw=False)
 
 	# the mirrorinfolist must be a list (duh)
 	if type(mirrorinfolist) != list:
@@ -372,6 +563,25 @@ def retrieve_mirrorinfolist(vendorlocation, defaultvendorport=62293):
 	return mirrorinfolist
 
 
+def pack_mirrorlist_capnp(mirrorinfolist):
+	"""packs a list of mirrorinfo dicts into a Cap'n Proto MirrorList"""
+	message = _raidpir_capnp.MirrorList.new_message()
+	mirrors = message.init('mirrors', len(mirrorinfolist))
+
+	for mirror, mirrorinfo in zip(mirrors, mirrorinfolist):
+		mirror.ip = mirrorinfo['ip']
+		mirror.port = mirrorinfo['port']
+
+	# the packed encoding drops the zero bytes of the word padding
+	return message.to_bytes_packed()
+
+
+def unpack_mirrorlist_capnp(rawmirrordata):
+	"""unpacks a Cap'n Proto MirrorList into a list of mirrorinfo dicts"""
+	message = _raidpir_capnp.MirrorList.from_bytes_packed(rawmirrordata)
+	return [{'ip':mirror.ip, 'port':mirror.port} for mirror in message.mirrors]
+
+
 # when a socket is already opened
 def _remote_query_helper_sock(socket, command):
 	# issue the relevant command
@@ -425,6 +635,71 @@ def _remote_query_helper(serverlocation, command, defaultserverport):
 	return rawanswer
 
 
+# SimpleQueue (Python >= 3.7) is cheaper than Queue
+_simplequeue = getattr(queue, 'SimpleQueue', queue.Queue)
+
+# the most queued writes that QueuedWriter writes in one go
+_queuedwriterbatch = 1024
+
+class QueuedWriter(object):
+	"""
+	<Purpose>
+		Wraps a file object so that writes are done by a background thread.
+		write only queues the data, so the caller never waits for the disk.
+		Used for logs that are written from time-critical code.
+
+	<Side Effects>
+		Starts a daemon thread. close must be called to write out the queued
+		data and close the file.
+	"""
+
+	def __init__(self, fileobj, flushinterval=None):
+		self.fileobj = fileobj
+		# flush the file at most every flushinterval seconds, for logs that are
+		# watched live. The writes in between are batched.
+		self.flushinterval = flushinterval
+		self.writequeue = _simplequeue()
+		self.writerthread = threading.Thread(target=self._writer, name="QueuedWriter", daemon=True)
+		self.writerthread.start()
+
+
+	def _writer(self):
+		"""writes the queued data until close queues None"""
+		while True:
+			pieces = [self.writequeue.get()]
+
+			# take whatever else is queued in the same go
+			while len(pieces) < _queuedwriterbatch:
+				try:
+					pieces.append(self.writequeue.get_nowait())
+				except queue.Empty:
+					break
+
+			if None in pieces:
+				self.fileobj.writelines(pieces[:pieces.index(None)])
+				return
+
+			self.fileobj.writelines(pieces)
+
+			if self.flushinterval != None:
+				self.fileobj.flush()
+				# let the next batch accumulate, unless we are falling behind
+				if len(pieces) < _queuedwriterbatch:
+					time.sleep(self.flushinterval)
+
+
+	def write(self, data):
+		"""queues data to be written"""
+		self.writequeue.put(data)
+
+
+	def close(self):
+		"""writes out everything that was queued and closes the file"""
+		self.writequeue.put(None)
+		self.writerthread.join()
+		self.fileobj.close()
+
+
 def parse_manifest(rawmanifestdata):
 	"""
 	<Purpose>
@@ -432,7 +707,8 @@ def parse_manifest(rawmanifestdata):
 		dictionary.
 
 	<Arguments>
-		rawmanifestdata: a string containing the raw manifest data as is produced by the json module.
+		rawmanifestdata: the raw manifest data as is produced by the msgpack module.
+										 bytes or any buffer of them (bytearray, memoryview, mmap)
 
 	<Exceptions>
 		TypeError or ValueError if the manifest data is corrupt
@@ -444,16 +720,32 @@ def parse_manifest(rawmanifestdata):
 		A dictionary containing the manifest.
 	"""
 
-	if type(rawmanifestdata) != bytes:
+	if not isinstance(rawmanifestdata, (bytes, bytearray, memoryview, mmap.mmap)):
 		raise TypeError("Raw manifest data must be bytes")
 
 	manifestdict = msgpack.unpackb(rawmanifestdata, raw=False)
 
 	_validate_manifest(manifestdict)
 
+	# files are looked up by name, index them once
+	_index_fileinfolist(manifestdict)
+
 	return manifestdict
 
 
+def _index_fileinfolist(manifestdict):
+	"""private helper. Returns the dict of filename -> fileinfo of a manifest.
+	It is built once and kept in the manifest under '_fileinfo_by_name'."""
+
+	if '_fileinfo_by_name' not in manifestdict:
+		fileinfobyname = {}
+		for fileinfo in manifestdict['fileinfolist']:
+			fileinfobyname[fileinfo['filename']] = fileinfo
+		manifestdict['_fileinfo_by_name'] = fileinfobyname
+
+	return manifestdict['_fileinfo_by_name']
+
+
 def populate_xordatastore(manifestdict, xordatastore, datasource, dstype,
 						  precompute):
 	"""
@@ -822,10 +1114,10 @@ def _find_blockloc_from_offset(offset, sizeofblocks):
 	return (int(offset / sizeofblocks), offset % sizeofblocks)
 
 
-def extract_file_from_blockdict(filename, manifestdict, blockdict):
+def iter_file_blocks(filename, manifestdict, blockdict):
 	"""
 	<Purpose>
-		Reconstitutes a file from a block dict
+		Walks through the pieces of a file in a block dict without copying them
 
 	<Arguments>
 		filename: the file within the release we are asking about
@@ -841,58 +1133,65 @@ def extract_file_from_blockdict(filename, manifestdict, blockdict):
 		None
 
 	<Returns>
-		A string containing the file contents
+		A generator of (fileoffset, length, data) tuples in file order. data is
+		a memoryview of the blockcontents.
 	"""
 
 	blocksize = manifestdict['blocksize']
 	database_layout = manifestdict['datastore_layout']
 
-	for fileinfo in manifestdict['fileinfolist']:
-		if filename == fileinfo['filename']:
+	fileinfo = get_fileinfo_for_file(filename, manifestdict)
 
-			if database_layout == 'nogaps':
-				offset = fileinfo['offset']
-				quantity = fileinfo['length']
+	quantity = fileinfo['length']
 
-				# Let's get the block information
-				(startblock, startoffset) = _find_blockloc_from_offset(offset, blocksize)
-				(endblock, endoffset) = _find_blockloc_from_offset(offset + quantity, blocksize)
+	# the offsets where the pieces of the file start. Every piece runs until
+	# the end of its block or the end of the file.
+	if database_layout == 'nogaps':
+		# the first piece and then the start of every following block
+		startblock = fileinfo['offset'] // blocksize
+		offsets = itertools.chain([fileinfo['offset']], range((startblock + 1) * blocksize, fileinfo['offset'] + quantity, blocksize))
+	elif database_layout == 'eqdist':
+		offsets = fileinfo['offsets']
+	else:
+		raise Exception("Unknown database layout")
 
-				# Case 1: this does not cross blocks
-				if startblock == endblock:
-					return blockdict[startblock][startoffset:endoffset]
+	fileoffset = 0
+	for offset in offsets:
+		if fileoffset >= quantity:
+			break
 
-				# Case 2: this crosses blocks
+		(block, blockoffset) = _find_blockloc_from_offset(offset, blocksize)
+		length = min(blocksize - blockoffset, quantity - fileoffset)
 
-				# we'll build up the string starting with the first block...
-				currentstring = blockdict[startblock][startoffset:]
+		yield (fileoffset, length, memoryview(blockdict[block])[blockoffset:blockoffset + length])
 
-				# now add in the 'middle' blocks.   This is all of the blocks
-				# after the start and before the end
-				for currentblock in range(startblock + 1, endblock):
-					currentstring += blockdict[currentblock]
+		fileoffset = fileoffset + length
 
-				# this check is needed because we might be past the last block.
-				if endoffset > 0:
-					# finally, add the end block.
-					currentstring += blockdict[endblock][:endoffset]
 
-				# and return the result
-				return currentstring
-			elif database_layout == 'eqdist':
-				offsets = fileinfo['offsets']
-				quantity = fileinfo['length']
+def extract_file_from_blockdict(filename, manifestdict, blockdict):
+	"""
+	<Purpose>
+		Reconstitutes a file from a block dict
 
-				currentstring = ''
+	<Arguments>
+		filename: the file within the release we are asking about
 
-				for offset in offsets:
-					(block, blockoffset) = _find_blockloc_from_offset(offset, blocksize)
-					currentstring += blockdict[block][blockoffset:]
+		manifestdict: the manifest for the release
+
+		blockdict: a dictionary of blocknum -> blockcontents
+
+	<Exceptions>
+		TypeError, IndexError, or KeyError if the args are incorrect
+
+	<Side Effects>
+		None
+
+	<Returns>
+		A string containing the file contents
+	"""
+
+	return b''.join([piece for _, _, piece in iter_file_blocks(filename, manifestdict, blockdict)])
 
-				currentstring = currentstring[:quantity]
-				return currentstring
-			else:
-				raise Exception("Unknown database layout")
 
 def get_blocklist_for_file(filename, manifestdict):
 	"""
@@ -912,28 +1211,51 @@ def get_blocklist_for_file(filename, manifestdict):
 		None
 
 	<Returns>
-		A list of blocks numbers
+		A sequence of blocks numbers (a range for the nogaps layout)
 	"""
 
 	blocksize = manifestdict['blocksize']
 
-	for fileinfo in manifestdict['fileinfolist']:
-		if filename == fileinfo['filename']:
-			if manifestdict['datastore_layout'] == 'nogaps':
-				# it's the starting offset / blocksize until the
-				# ending offset -1 divided by the blocksize
-				# I do + 1 because range will otherwise omit the last block
-				return range(int(fileinfo['offset'] / blocksize), int((fileinfo['offset'] + fileinfo['length'] - 1) / blocksize + 1))
-			elif manifestdict['datastore_layout'] == 'eqdist':
-				offsets = fileinfo['offsets']
-				blocks = []
-				for offset in offsets:
-					blocks.append(int(offset/blocksize))
-				return blocks
-			else:
-				raise Exception("Unknown datastore layout")
+	fileinfo = get_fileinfo_for_file(filename, manifestdict)
+
+	if manifestdict['datastore_layout'] == 'nogaps':
+		# it's the starting offset / blocksize until the
+		# ending offset -1 divided by the blocksize
+		# I do + 1 because range will otherwise omit the last block
+		return range(fileinfo['offset'] // blocksize, (fileinfo['offset'] + fileinfo['length'] - 1) // blocksize + 1)
+	elif manifestdict['datastore_layout'] == 'eqdist':
+		blocks = []
+		for offset in fileinfo['offsets']:
+			blocks.append(offset // blocksize)
+		return blocks
+	else:
+		raise Exception("Unknown datastore layout")
+
+
+def get_fileinfo_for_file(filename, manifestdict):
+	"""
+	<Purpose>
+		Get the manifest entry of a file
+
+	<Arguments>
+		filename: the file within the release we are asking about
 
-	raise TypeError("File is not in manifest")
+		manifestdict: the manifest for the release
+
+	<Exceptions>
+		TypeError if the file is not in the manifest
+
+	<Side Effects>
+		Indexes the files of the manifest on the first call
+
+	<Returns>
+		The fileinfo dictionary of the file
+	"""
+
+	try:
+		return _index_fileinfolist(manifestdict)[filename]
+	except KeyError:
+		raise TypeError("File is not in manifest")
 
 
 def get_filenames_in_release(manifestdict):
@@ -962,65 +1284,80 @@ def get_filenames_in_release(manifestdict):
 	return filenamelist
 
 
-def _generate_fileinfolist(startdirectory, hashalgorithm="sha256-raw"):
-	"""private helper.   Generates a list of file information dictionaries for all files under startdirectory."""
+def _generate_fileinfolist(startdirectory, hashalgorithm="sha256-raw", database=None):
+	"""private helper.   Generates a list of file information dictionaries for all files under startdirectory.
+	If database is given, the files are copied into a single database file with that name in the same pass."""
 
 	fileinfo_list = []
 
-	# let's walk through the directories and add the files + sizes
-	for parentdir, junkchilddirectories, filelist in os.walk(startdirectory):
-		for filename in filelist:
-			thisfiledict = {}
+	if database != None:
+		dbfd = os.open(database, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+		_write_all(dbfd, b"RAIDPIRDB_" + pirversion.encode('utf-8'))
+
+	try:
+		# let's walk through the directories and add the files + sizes
+		for parentdir, junkchilddirectories, filelist in os.walk(startdirectory):
+			for filename in filelist:
+				thisfiledict = {}
+
+				# we want the relative name in the manifest, not the actual path / name
+				thisfiledict['filename'] = filename
+				fullfilename = os.path.join(parentdir, filename)
 
-			# we want the relative name in the manifest, not the actual path / name
-			thisfiledict['filename'] = filename
-			fullfilename = os.path.join(parentdir, filename)
+				thisfiledict['length'] = os.path.getsize(fullfilename)
 
-			thisfiledict['length'] = os.path.getsize(fullfilename)
+				# get the hash
+				if database == None:
+					thisfiledict['hash'] = find_file_hash(fullfilename, hashalgorithm)
+				else:
+					thisfiledict['hash'] = _copy_and_hash_file(fullfilename, hashalgorithm, dbfd)
 
-			# get the hash
-			fd = open(fullfilename, 'rb')
-			filecontents = fd.read()
-			thisfiledict['hash'] = find_hash(filecontents, hashalgorithm)
+				fileinfo_list.append(thisfiledict)
 
-			fd.close()
-			del filecontents
-			del fd
+	finally:
+		if database != None:
+			os.close(dbfd)
 
-			fileinfo_list.append(thisfiledict)
+	if database != None:
+		print("Database", database, "created.")
 
 	print("[INFO] Fileinfolist generation done.")
 	return fileinfo_list
 
 
-def _write_db(startdirectory, dbname):
-	"""private helper. Writes all files into a single db file"""
+def _copy_and_hash_file(filename, algorithm, dbfd):
+	"""private helper. Appends a file to the database file descriptor dbfd and
+	returns its hash. Every piece of the memory-mapped file is hashed and written
+	while it is still in the page cache, so the file is read only once."""
+
+	hashobj = new_hash(algorithm)
 
-	oo = open(dbname, 'wb')
+	with open(filename, 'rb') as fileobj:
+		length = os.fstat(fileobj.fileno()).st_size
 
-	# Header
-	oo.write(b"RAIDPIRDB_" + pirversion.encode('utf-8'))
+		# empty files can't be mapped, there is nothing to copy anyway
+		if length > 0:
+			with mmap.mmap(fileobj.fileno(), 0, prot=mmap.PROT_READ) as filemap:
+				# the file is read front to back, let the kernel read ahead
+				if hasattr(os, 'posix_fadvise'):
+					os.posix_fadvise(fileobj.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL | os.POSIX_FADV_WILLNEED)
 
-	# let's walk through the directories and add the files + sizes
-	for parentdir, junkchilddirectories, filelist in os.walk(startdirectory):
-		for filename in filelist:
-			thisfiledict = {}
-			# we want the relative name in the manifest, not the actual path / name
-			fullfilename = os.path.join(parentdir, filename)
+				with memoryview(filemap) as fileview:
+					for offset in range(0, length, _hashreadsize):
+						with fileview[offset:offset + _hashreadsize] as piece:
+							if hashobj != None:
+								hashobj.update(piece)
+							_write_all(dbfd, piece)
 
-			# open and read file
-			fd = open(fullfilename)
-			filecontents = fd.read()
+	return hash_digest(hashobj, algorithm)
 
-			#append it to single db file
-			oo.write(filecontents);
 
-			fd.close()
-			del filecontents
-			del fd
+def _write_all(fd, data):
+	"""private helper. Writes all of data to the file descriptor fd"""
 
-	print("Database", dbname, "created.")
-	oo.close();
+	data = memoryview(data)
+	while len(data) > 0:
+		data = data[os.write(fd, data):]
 
 
 def bits_to_bytes(num_bits):
@@ -1076,7 +1413,75 @@ def flip_array_bit(ba, bitnum):
 	return ba
 
 
-def create_manifest(rootdir=".", hashalgorithm="sha256-raw", block_size=1024 * 1024, datastore_layout="nogaps", vendorhostname=None, vendorport=62293):
+def _xor_dtype(length):
+	"""private helper. Work on 64 bit words whenever the length allows it"""
+	if length % 8 == 0:
+		return numpy.uint64
+	else:
+		return numpy.uint8
+
+
+def xor_accumulate(accumulator, string):
+	"""
+	<Purpose>
+		XORs a byte string into an accumulator in place, so that answers can be
+		combined as they arrive instead of being kept until all are there
+
+	<Arguments>
+		accumulator: None for the first string, otherwise the array returned by
+		the previous call
+
+		string: a bytes-like object, of the same length as the previous ones
+
+	<Exceptions>
+		ValueError if the strings differ in length
+
+	<Returns>
+		The accumulator, a numpy array. Its tobytes() is the XOR of all strings.
+	"""
+
+	if accumulator is None:
+		return numpy.frombuffer(string, dtype=_xor_dtype(len(string))).copy()
+
+	# numpy would broadcast a string of a single word
+	if len(string) != accumulator.nbytes:
+		raise ValueError("Strings differ in length")
+
+	numpy.bitwise_xor(accumulator, numpy.frombuffer(string, dtype=accumulator.dtype), out=accumulator)
+	return accumulator
+
+
+def xor_reduce(stringlist):
+	"""
+	<Purpose>
+		XORs a list of byte strings together
+
+	<Arguments>
+		stringlist: a non-empty list of bytes-like objects of the same length
+
+	<Exceptions>
+		ValueError if the strings differ in length
+
+	<Returns>
+		The XOR of all strings as bytes
+	"""
+
+	dtype = _xor_dtype(len(stringlist[0]))
+
+	# the strings are folded into one buffer, they are not copied
+	result = numpy.frombuffer(stringlist[0], dtype=dtype).copy()
+
+	for string in stringlist[1:]:
+		# numpy would broadcast a string of a single word
+		if len(string) != result.nbytes:
+			raise ValueError("Strings differ in length")
+
+		numpy.bitwise_xor(result, numpy.frombuffer(string, dtype=dtype), out=result)
+
+	return result.tobytes()
+
+
+def create_manifest(rootdir=".", hashalgorithm="sha256-raw", block_size=1024 * 1024, datastore_layout="nogaps", vendorhostname=None, vendorport=62293, database=None):
 	"""
 	<Purpose>
 		Create a manifest
@@ -1090,6 +1495,9 @@ def create_manifest(rootdir=".", hashalgorithm="sha256-raw", block_size=1024 * 1
 
 		datastore_layout: specifies how to lay out the files in blocks.
 
+		database: if given, the files are also copied into a single database
+		file with this name while they are hashed.
+
 	<Exceptions>
 		TypeError if the arguments are corrupt or of the wrong type
 
@@ -1127,7 +1535,7 @@ def create_manifest(rootdir=".", hashalgorithm="sha256-raw", block_size=1024 * 1
 	manifestdict['datastore_layout'] = datastore_layout
 
 	# first get the file information
-	fileinfolist = _generate_fileinfolist(rootdir, manifestdict['hashalgorithm'])
+	fileinfolist = _generate_fileinfolist(rootdir, manifestdict['hashalgorithm'], database)
 
 	# Let's see how many blocks we need
 	db_length = 0
@@ -1253,17 +1661,23 @@ def build_bitstring_from_chunks_parallel(chunks, k, chunklen, lastchunklen):
 def initAES(seed):
 	"""
 	<Purpose>
-		initializes the AES cipher and resets the counter
+		initializes the AES cipher and resets the counter. The counter starts
+		at 1 with either backend, so clients and mirrors produce the same
+		key stream no matter which of them they use.
 
 	<Arguments>
 		seed: the aes key
 
 	<Returns>
-		an initialized cipher object
+		a function that encrypts a string with the next bytes of the key stream
 	"""
 
+	if Cipher != None:
+		ctr = (1).to_bytes(16, byteorder = 'big')
+		return Cipher(algorithms.AES(seed), modes.CTR(ctr), backend=default_backend()).encryptor().update
+
 	ctr = Counter.new(128)
-	return AES.new(seed, AES.MODE_CTR, counter=ctr)
+	return AES.new(seed, AES.MODE_CTR, counter=ctr).encrypt
 
 
 def nextrandombitsAES(cipher, bitlength):
@@ -1288,11 +1702,11 @@ def nextrandombitsAES(cipher, bitlength):
 	if bitoffset > 0:
 		# if the bitlength is not a multiple of 8, clear the rightmost bits
 		pt = (bytelength - 1) * b'\0'
-		randombytes = cipher.encrypt(pt)
-		b = cipher.encrypt(b'\0')
+		randombytes = cipher(pt)
+		b = cipher(b'\0')
 		b = (b[0] & ((0xff00 >> bitoffset) & 0xff)).to_bytes(1, byteorder = 'big')
 		randombytes += b
 		return randombytes
 	else:
 		pt = bytelength * b'\0'
-		return cipher.encrypt(pt)
+		return cipher(pt)
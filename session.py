@@ -16,6 +16,11 @@ def recvmessage(socketobj):
 
 	# receive length of next message
 	msglen = socketobj.recv(lengthbytes)
+
+	# a connection that was closed reads as an empty message
+	if 0 < len(msglen) < lengthbytes:
+		msglen = msglen + _recvexactly(socketobj, lengthbytes - len(msglen))
+
 	messagesize = int.from_bytes(msglen, byteorder = 'big', signed=True)
 
 	#print("rcv", messagesize, end="")
@@ -31,17 +36,24 @@ def recvmessage(socketobj):
 	if messagesize < 0:
 		raise ValueError("Bad message size")
 
-	data = b''
-	while len(data) < messagesize:
-		chunk =	socketobj.recv(messagesize-len(data))
-		if chunk == b'':
-			raise SessionEOF("Connection Closed")
-		data = data + chunk
+	data = _recvexactly(socketobj, messagesize)
 
 	#print(":", data[:8])
 
 	return data
 
+# a private helper function that receives exactly size bytes
+def _recvexactly(socketobj, size):
+	chunks = []
+	while size > 0:
+		chunk = socketobj.recv(size)
+		if chunk == b'':
+			raise SessionEOF("Connection Closed")
+		chunks.append(chunk)
+		size = size - len(chunk)
+
+	return b''.join(chunks)
+
 # a private helper function
 def _sendhelper(socketobj, data):
 	#print("send", len(data), ":", str(data[0:8]), "...")
@@ -62,3 +74,49 @@ def sendmessage(socketobj, data):
 
 	#the data
 	_sendhelper(socketobj, data)
+
+# frame a message (length followed by the data) so it can be put on the wire
+# in one piece, e.g. by a non-blocking socket
+def framemessage(data):
+	if type(data) == str:
+		data = str.encode(data)
+
+	return len(data).to_bytes(lengthbytes, byteorder = 'big', signed=True) + data
+
+# frame a message that is given as a list of buffers. The buffers are not
+# copied, the length header is simply put in front of them so the message can
+# be sent with a single sendmsg (scatter-gather) call
+def framebuffers(buffers):
+	messagesize = 0
+	for buf in buffers:
+		messagesize = messagesize + len(buf)
+
+	return [messagesize.to_bytes(lengthbytes, byteorder = 'big', signed=True)] + buffers
+
+# split all complete messages off the front of a receive buffer (a bytearray
+# filled from a non-blocking socket). Incomplete data is left in the buffer.
+def popmessages(buf):
+	messages = []
+	offset = 0
+
+	while len(buf) - offset >= lengthbytes:
+		messagesize = int.from_bytes(buf[offset:offset+lengthbytes], byteorder = 'big', signed=True)
+
+		# end of messages
+		if messagesize == -1:
+			raise SessionEOF("Connection Closed")
+
+		if messagesize < 0:
+			raise ValueError("Bad message size")
+
+		# the rest of this message did not arrive yet
+		if len(buf) - offset - lengthbytes < messagesize:
+			break
+
+		offset = offset + lengthbytes
+		messages.append(bytes(buf[offset:offset+messagesize]))
+		offset = offset + messagesize
+
+	del buf[:offset]
+
+	return messages
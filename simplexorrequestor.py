@@ -9,9 +9,6 @@
 
 """
 
-# I'll use this to XOR the result together
-import fastsimplexordatastore as xordatastore
-
 # helper functions that are shared
 import raidpirlib as lib
 
@@ -43,49 +40,19 @@ import random
 
 ########################### XORRequestGenerator ################################
 
-# receive thread
-def rcvlet(mirror, rxgobj):
-	sock = mirror['info']['sock']
-
-	# first, check if params were received correctly
-	if session.recvmessage(sock) != b'PARAMS OK':
-		raise Exception("Params were not delivered correctly or wrong format.")
-
-	data = "0"
-	first = True
-	while data != '' and len(mirror['blocksrequested']) > 0 or first:
-		first = False
-		data = session.recvmessage(sock)
-		rxgobj.notify_success(mirror['info'], data)
-
-
-def _reconstruct_block(blockinfolist):
-	# private helper to reconstruct a block
-
-	# xor the blocks together
-	ret = blockinfolist[0]
-	for xorblock in blockinfolist[1:]:
-		ret = xordatastore.do_xor(ret, xorblock)
-
-	# and return the answer
-	return ret
-
-
-def _reconstruct_block_parallel(responses, chunklen, k, blocklen, blocknumbers):
-	#reconstruct block(s) from parallel query answer
+def _reconstruct_block_parallel(accumulators, chunklen, k, blocklen, blocknumbers):
+	#reconstruct block(s) from the accumulated answers of a parallel query
 
 	results = {}
 	for blocknum in blocknumbers:
 		#map blocknum to chunk
-		index = min(int(blocknum/chunklen), k-1)
+		index = min(blocknum // chunklen, k-1)
 
 		if index not in results:
-			results[index] = blocklen*b'\0'
-
-	for m in range(k):
-		for c in results:
-			if c in responses[m]:
-				results[c] = xordatastore.do_xor(results[c], responses[m][c])
+			if index in accumulators:
+				results[index] = accumulators[index].tobytes()
+			else:
+				results[index] = blocklen*b'\0'
 
 	return results
 
@@ -126,6 +93,101 @@ class Requestor(object):
 		return self.finishedblockdict[blocknum]
 
 
+	def _connect_mirror(self, mirror):
+		"""opens a connection to the mirror and sends it mirror['params']. The
+		answer has to be checked with _check_params_received"""
+		sock = socket.create_connection((mirror['info']['ip'], mirror['info']['port']))
+		mirror['info']['sock'] = sock
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+		# acknowledge answers right away instead of delaying the ACK (Linux only)
+		if hasattr(socket, 'TCP_QUICKACK'):
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+		session.sendmessage(sock, b"P" + msgpack.packb(mirror['params'], use_bin_type=True))
+
+
+	def _check_params_received(self, mirrors):
+		"""the mirrors acknowledge the parameters before any query is sent"""
+		for mirror in mirrors:
+			if session.recvmessage(mirror['info']['sock']) != b'PARAMS OK':
+				raise Exception("Params were not delivered correctly or wrong format.")
+
+
+	def _send_request(self, mirror, blocknum, request):
+		"""keeps track of a request until its answer arrives"""
+		mirror['pendingrequests'].append((blocknum, request))
+		return request
+
+
+	def _resend_request(self, mirror):
+		"""hands out the next request that a failed mirror did not answer"""
+		blocknum, request = mirror['resendrequests'].pop(0)
+
+		# it goes to the replacement now
+		return self._send_request(mirror, blocknum, (mirror['info'],) + request[1:])
+
+
+	def notify_failure(self, tid):
+		"""
+		<Purpose>
+			Handles that the connection to a mirror has failed. The mirror is
+			replaced with one we haven't chosen yet. The replacement gets the
+			same params and all requests the failed mirror did not answer.
+
+		<Arguments>
+			tid: the index of the failed mirror in activemirrors
+
+		<Exceptions>
+			InsufficientMirrors if there are not enough mirrors
+
+		<Returns>
+			None
+
+		"""
+		# I should lock the table...
+		self.tablelock.acquire()
+
+		# but *always* release it
+		try:
+			mirror = self.activemirrors[tid]
+
+			self.failurecount = self.failurecount + 1
+			mirror['info']['sock'].close()
+
+			# a replacement starts the AES stream of the seed from the beginning,
+			# so it has to see the answered requests again. Those answers are dropped.
+			resendrequests = [(None, request) for request in mirror['answeredrequests']]
+			for blocknum, request in mirror['pendingrequests'] + mirror['resendrequests']:
+				if blocknum != None:
+					resendrequests.append((blocknum, request))
+
+			mirror['pendingrequests'] = []
+			mirror['resendrequests'] = resendrequests
+
+			while True:
+				# if we're out of replacements, quit
+				if len(self.backupmirrorinfolist) == 0:
+					raise InsufficientMirrors("There are no replacement mirrors")
+
+				mirror['info'] = self.backupmirrorinfolist.pop(0)
+
+				try:
+					self._connect_mirror(mirror)
+					self._check_params_received([mirror])
+					return
+
+				except (OSError, session.SessionEOF):
+					# this one is offline as well
+					self.failurecount = self.failurecount + 1
+					if 'sock' in mirror['info']:
+						mirror['info']['sock'].close()
+
+		finally:
+			# release the lock
+			self.tablelock.release()
+
+
 
 # These provide an easy way for the client XOR request behavior to be
 # modified. If you wanted to change the policy by which mirrors are selected,
@@ -136,7 +198,7 @@ class RandomXORRequestor(Requestor):
 	<Purpose>
 		Basic XORRequestGenerator that just picks some number of random mirrors
 		and then retrieves all blocks from them. If any mirror fails or is
-		offline, the operation fails.
+		offline and there is no replacement, the operation fails.
 
 		The strategy this uses is very, very simple. First we randomly choose
 		$k$ mirrors we want to retrieve blocks from. If at any point, we have
@@ -189,19 +251,8 @@ class RandomXORRequestor(Requestor):
 		for mirrorinfo in self.fullmirrorinfolist[:self.privacythreshold]:
 			mirrors = {}
 			mirrors['info'] = mirrorinfo
-			mirrors['blocksneeded'] = blocklist[:]
-			mirrors['blockbitstringlist'] = []
-			mirrors['blocksrequested'] = []
-
-			# open a socket once:
-			mirrors['info']['sock'] = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			mirrors['info']['sock'].setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) #TODO check this in the cloud
-			mirrors['info']['sock'].connect((mirrorinfo['ip'], mirrorinfo['port']))
-
-			self.activemirrors.append(mirrors)
 
-		for thisrequestinfo in self.activemirrors:
-			#send parameters to mirrors once
+			#the parameters of the mirror, sent once
 			params = {}
 			params['cn'] = 1 # chunk numbers, here fixed to 1
 			params['k'] = privacythreshold
@@ -210,54 +261,87 @@ class RandomXORRequestor(Requestor):
 			params['lcl'] = 1 # last chunk length, here fixed to 1
 			params['b'] = batch
 			params['p'] = False
+			mirrors['params'] = params
+
+			# only a mirror with an AES seed needs them again after a failure
+			mirrors['answeredrequests'] = []
+
+			self.activemirrors.append(mirrors)
+
+		# open a socket once and send the params, the response is checked below
+		for mirror in self.activemirrors:
+			self._connect_mirror(mirror)
+		self._check_params_received(self.activemirrors)
+
+		# want to have a structure for locking
+		self.tablelock = threading.Lock()
+
+		# and we'll keep track of the ones that are waiting in the wings...
+		self.backupmirrorinfolist = self.fullmirrorinfolist[self.privacythreshold:]
+
+		# the queries for the first batch
+		self.next_batch(blocklist)
 
-			#send the params, rcvlet will check response
-			session.sendmessage(thisrequestinfo['info']['sock'], b"P" + msgpack.packb(params, use_bin_type=True))
+		# and we're ready!
+
+
+	def next_batch(self, blocklist):
+		"""
+		<Purpose>
+			Prepares the queries for another batch of blocks. The connections
+			and the parameters sent to the mirrors are kept, so a session can
+			retrieve several batches one after the other.
+
+		<Arguments>
+			blocklist: the blocks that need to be retrieved
+
+		<Exceptions>
+			None
 
-			# start separate receiving thread for this socket
-			t = threading.Thread(target=rcvlet, args=[thisrequestinfo, self], name=("rcv_thread_" + str((thisrequestinfo['info']['ip'], thisrequestinfo['info']['port']))))
-			thisrequestinfo['rt'] = t
-			t.start()
+		<Returns>
+			None
+		"""
+		self.blocklist = blocklist
 
-		bitstringlength = lib.bits_to_bytes(manifestdict['blockcount'])
+		for thisrequestinfo in self.activemirrors:
+			thisrequestinfo['blocksneeded'] = blocklist[:]
+			thisrequestinfo['blockbitstringlist'] = []
+			thisrequestinfo['pendingrequests'] = []
+			thisrequestinfo['resendrequests'] = []
 
 		# let's generate the random bitstrings for k-1 mirrors
 		for thisrequestinfo in self.activemirrors[:-1]:
 
 			for _ in blocklist:
-				thisrequestinfo['blockbitstringlist'].append(lib.randombits(manifestdict['blockcount']))
+				thisrequestinfo['blockbitstringlist'].append(lib.randombits(self.manifestdict['blockcount']))
 
 		# now, let's do the 'derived' ones...
 		for blocknum in range(len(blocklist)):
-			thisbitstring = b'\0'*bitstringlength
 
 			# xor the random strings together
-			for requestinfo in self.activemirrors[:-1]:
-				thisbitstring = xordatastore.do_xor(thisbitstring, requestinfo['blockbitstringlist'][blocknum])
+			thisbitstring = bytearray(lib.xor_reduce([requestinfo['blockbitstringlist'][blocknum] for requestinfo in self.activemirrors[:-1]]))
 
 			# flip the appropriate bit for the block we want
-			thisbitstring = lib.flip_bitstring_bit(thisbitstring, blocklist[blocknum])
+			lib.flip_array_bit(thisbitstring, blocklist[blocknum])
 
 			# store the result for the last mirror
-			self.activemirrors[-1]['blockbitstringlist'].append(thisbitstring)
+			self.activemirrors[-1]['blockbitstringlist'].append(bytes(thisbitstring))
 
-		# want to have a structure for locking
-		self.tablelock = threading.Lock()
-
-		# and we'll keep track of the ones that are waiting in the wings...
-		self.backupmirrorinfolist = self.fullmirrorinfolist[self.privacythreshold:]
+		# failed requests of this batch are counted here and reported by the caller
+		self.failurecount = 0
 
-		# the returned blocks are put here...
+		# the returned blocks are XORed together here as they arrive...
 		self.returnedxorblocksdict = {}
+		# ...and counted here
+		self.returnedcountdict = {}
 		for blocknum in blocklist:
-			# make these all empty lists to start with
-			self.returnedxorblocksdict[blocknum] = []
+			# nothing has arrived yet
+			self.returnedxorblocksdict[blocknum] = None
+			self.returnedcountdict[blocknum] = 0
 
 		# and here is where they are put when reconstructed
 		self.finishedblockdict = {}
 
-		# and we're ready!
-
 
 	def get_next_xorrequest(self, tid):
 		"""
@@ -282,60 +366,18 @@ class RandomXORRequestor(Requestor):
 
 		mirror = self.activemirrors[tid]
 
+		# the requests of a failed mirror go first
+		if len(mirror['resendrequests']) > 0:
+			return self._resend_request(mirror)
+
 		# this mirror is done...
 		if len(mirror['blocksneeded']) == 0:
 			return ()
 
 		# otherwise set it to be taken...
 		blocknum = mirror['blocksneeded'].pop()
-		mirror['blocksrequested'].append(blocknum)
-
-		return (mirror['info'], blocknum, mirror['blockbitstringlist'].pop())
-
-
-	def notify_failure(self, xorrequesttuple):
-		"""
-		<Purpose>
-			Handles that a mirror has failed
-
-		<Arguments>
-			The XORrequesttuple that was returned by get_next_xorrequest
-
-		<Exceptions>
-			InsufficientMirrors if there are not enough mirrors
-
-			An internal error is raised if the XORrequesttuple is bogus
 
-		<Returns>
-			None
-
-		"""
-		# I should lock the table...
-		self.tablelock.acquire()
-
-		# but *always* release it
-		try:
-			# if we're out of replacements, quit
-			if len(self.backupmirrorinfolist) == 0:
-				raise InsufficientMirrors("There are no replacement mirrors")
-
-			nextmirrorinfo = self.backupmirrorinfolist.pop(0)
-
-			failedmirrorsinfo = xorrequesttuple[0]
-
-			# now, let's find the activemirror this corresponds to.
-			for mirror in self.activemirrors:
-				if mirror['info'] == failedmirrorsinfo:
-
-					# let's mark it as inactive and set up a different mirror
-					mirror['info'] = nextmirrorinfo
-					return
-
-			raise Exception("InternalError: Unknown mirror in notify_failure")
-
-		finally:
-			# release the lock
-			self.tablelock.release()
+		return self._send_request(mirror, blocknum, (mirror['info'], blocknum, mirror['blockbitstringlist'].pop()))
 
 
 	def notify_success(self, thismirrorsinfo, xorblock):
@@ -370,17 +412,18 @@ class RandomXORRequestor(Requestor):
 				if mirror['info'] == thismirrorsinfo:
 
 					# remove the block and bitstring (asserting they match what we said before)
-					blocknumber = mirror['blocksrequested'].pop(0)
+					blocknumber, _ = mirror['pendingrequests'].pop(0)
 
-					# add the xorblockinfo to the dict
-					self.returnedxorblocksdict[blocknumber].append(xorblock)
+					# xor the xorblock into what we have so far
+					self.returnedxorblocksdict[blocknumber] = lib.xor_accumulate(self.returnedxorblocksdict[blocknumber], xorblock)
+					self.returnedcountdict[blocknumber] = self.returnedcountdict[blocknumber] + 1
 
 					# if we don't have all of the pieces, continue
-					if len(self.returnedxorblocksdict[blocknumber]) != self.privacythreshold:
+					if self.returnedcountdict[blocknumber] != self.privacythreshold:
 						return
 
-					# if we have all of the pieces, reconstruct it
-					resultingblock = _reconstruct_block(self.returnedxorblocksdict[blocknumber])
+					# if we have all of the pieces, the block is reconstructed
+					resultingblock = self.returnedxorblocksdict[blocknumber].tobytes()
 
 					# let's check the hash...
 					resultingblockhash = lib.find_hash(resultingblock, self.manifestdict['hashalgorithm'])
@@ -393,6 +436,7 @@ class RandomXORRequestor(Requestor):
 
 					# it should be safe to delete this
 					del self.returnedxorblocksdict[blocknumber]
+					del self.returnedcountdict[blocknumber]
 					return
 
 			raise Exception("InternalError: Unknown mirror in notify_success")
@@ -436,7 +480,7 @@ class RandomXORRequestorChunks(Requestor):
 
 		#length of one chunk in BITS (1 bit per block)
 		#chunk length of the first chunks must be a multiple of 8, last chunk can be longer than first chunks
-		self.chunklen = int(self.blockcount/8/privacythreshold) * 8
+		self.chunklen = (self.blockcount // 8 // privacythreshold) * 8
 		self.lastchunklen = self.blockcount - (privacythreshold-1)*self.chunklen
 
 		if len(mirrorinfolist) < self.privacythreshold:
@@ -455,14 +499,6 @@ class RandomXORRequestorChunks(Requestor):
 		for mirrorinfo in self.fullmirrorinfolist[:self.privacythreshold]:
 			mirror = {}
 			mirror['info'] = mirrorinfo
-			mirror['blocksneeded'] = blocklist[:] # only for the client, obviously
-			mirror['blocksrequested'] = []
-
-			if parallel:
-				mirror['parallelblocksneeded'] = []
-
-			mirror['blockchunklist'] = []
-
 
 			# chunk numbers [0, ..., r-1]
 			mirror['chunknumbers'] = [i]
@@ -470,20 +506,13 @@ class RandomXORRequestorChunks(Requestor):
 				mirror['chunknumbers'].append((i+j) % privacythreshold)
 			i = i + 1
 
-			#open a socket once:
-			mirror['info']['sock'] = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			mirror['info']['sock'].connect((mirrorinfo['ip'], mirrorinfo['port']))
-
 			if rng:
 				#pick a random seed (key) and initialize AES
 				seed = _randomnumberfunction(16) # random 128 bit key
 				mirror['seed'] = seed
 				mirror['cipher'] = lib.initAES(seed)
 
-			self.activemirrors.append(mirror)
-
-		for mirror in self.activemirrors:
-			#send parameters to mirrors once
+			#the parameters of the mirror, sent once
 			params = {}
 			params['cn'] = mirror['chunknumbers']
 			params['k'] = privacythreshold
@@ -496,17 +525,63 @@ class RandomXORRequestorChunks(Requestor):
 			if rng:
 				params['s'] = mirror['seed']
 
-			#send the params, rcvlet will check response
-			session.sendmessage(mirror['info']['sock'], b"P" + msgpack.packb(params, use_bin_type=True))
+			mirror['params'] = params
+
+			# a replacement for this mirror has to get them again (rng only)
+			mirror['answeredrequests'] = []
+
+			self.activemirrors.append(mirror)
+
+		# open a socket once and send the params, the response is checked below
+		for mirror in self.activemirrors:
+			self._connect_mirror(mirror)
+		self._check_params_received(self.activemirrors)
+
+		# want to have a structure for locking
+		self.tablelock = threading.Lock()
+
+		# and we'll keep track of the ones that are waiting in the wings...
+		self.backupmirrorinfolist = self.fullmirrorinfolist[self.privacythreshold:]
+
+		# the queries for the first batch
+		self.next_batch(blocklist)
+
+		# preparation done. queries are ready to be sent.
+
+
+	def next_batch(self, blocklist):
+		"""
+		<Purpose>
+			Prepares the queries for another batch of blocks. The connections,
+			the parameters and the AES streams of the mirrors are kept, so a
+			session can retrieve several batches one after the other.
 
-			# start separate receiving thread for this socket
-			t = threading.Thread(target=rcvlet, args=[mirror, self], name=("rcv_thread_" + str((mirror['info']['ip'], mirror['info']['port']))))
-			mirror['rt'] = t
-			t.start()
+		<Arguments>
+			blocklist: the blocks that need to be retrieved
+
+		<Exceptions>
+			None
+
+		<Returns>
+			None
+		"""
+		privacythreshold = self.privacythreshold
+		rng = self.rng
 
+		self.blocklist = blocklist
+
+		for mirror in self.activemirrors:
+			mirror['blocksneeded'] = blocklist[:] # only for the client, obviously
+			mirror['pendingrequests'] = []
+			mirror['resendrequests'] = []
+
+			if self.parallel:
+				mirror['parallelblocksneeded'] = []
+
+			mirror['blockchunklist'] = []
 
 		#multi block query. map the blocks to the minimum amount of queries
-		if parallel:
+		if self.parallel:
 
 			#create dictionary for each chunk, will hold block indices per chunk
 			blockchunks = {}
@@ -515,7 +590,7 @@ class RandomXORRequestorChunks(Requestor):
 
 			#map block numbers to chunks
 			for blocknum in blocklist:
-				index = min(int(blocknum/self.chunklen), privacythreshold-1)
+				index = min(blocknum // self.chunklen, privacythreshold-1)
 				blockchunks[index].append(blocknum)
 
 			#remove chunks that are still empty
@@ -566,26 +641,27 @@ class RandomXORRequestorChunks(Requestor):
 					else:
 						length = self.chunklen
 
-					#fill it with zero
-					thisbitstring = lib.bits_to_bytes(length)*b'\0'
-
-					#xor all other rnd chunks onto it
+					#start with zero and collect all other rnd chunks
+					rndchunks = [lib.bits_to_bytes(length)*b'\0']
 					for rqi in self.activemirrors:
 						if c in rqi['blockchunklist'][-1]:
-							thisbitstring = xordatastore.do_xor(thisbitstring, rqi['blockchunklist'][-1][c])
+							rndchunks.append(rqi['blockchunklist'][-1][c])
 							if rng:
 								del rqi['blockchunklist'][-1][c] #remove the pre-computed random chunk from the packet to send
 
+					#xor them together
+					thisbitstring = bytearray(lib.xor_reduce(rndchunks))
+
 					#if there is a block within this chunk, then add it to the bitstring by flipping the bit
 					if c in blockchunks:
 						blocknum = blockchunks[c].pop(0)
-						thisbitstring = lib.flip_bitstring_bit(thisbitstring, blocknum - c*self.chunklen)
+						lib.flip_array_bit(thisbitstring, blocknum - c*self.chunklen)
 						blocks.append(blocknum)
 						if len(blockchunks[c]) == 0:
 							del blockchunks[c]
 
 					mirror['parallelblocksneeded'].append(blocks)
-					mirror['blockchunklist'][-1][c] = thisbitstring
+					mirror['blockchunklist'][-1][c] = bytes(thisbitstring)
 
 
 		#single block query:
@@ -628,42 +704,41 @@ class RandomXORRequestorChunks(Requestor):
 					else:
 						length = self.chunklen
 
-					#fill it with zero
-					thisbitstring = lib.bits_to_bytes(length)*b'\0'
-
-					#xor all other rnd chunks onto it
+					#start with zero and collect all other rnd chunks
+					rndchunks = [lib.bits_to_bytes(length)*b'\0']
 					for rqi in self.activemirrors:
 						if c in rqi['blockchunklist'][-1]:
-							thisbitstring = xordatastore.do_xor(thisbitstring, rqi['blockchunklist'][-1][c])
+							rndchunks.append(rqi['blockchunklist'][-1][c])
 							if rng:
 								del rqi['blockchunklist'][-1][c] #remove the pre-computed random chunk from the packet to send
 
+					#xor them together
+					thisbitstring = bytearray(lib.xor_reduce(rndchunks))
+
 					#if the desired block is within this chunk, flip the bit
 					if c*self.chunklen <= blocknum and blocknum < c*self.chunklen + length:
-						thisbitstring = lib.flip_bitstring_bit(thisbitstring, blocknum - c*self.chunklen)
+						lib.flip_array_bit(thisbitstring, blocknum - c*self.chunklen)
 
-					mirror['blockchunklist'][-1][c] = thisbitstring
+					mirror['blockchunklist'][-1][c] = bytes(thisbitstring)
 
 
 		########################################
 
-		# want to have a structure for locking
-		self.tablelock = threading.Lock()
+		# failed requests of this batch are counted here and reported by the caller
+		self.failurecount = 0
 
-		# and we'll keep track of the ones that are waiting in the wings...
-		self.backupmirrorinfolist = self.fullmirrorinfolist[self.privacythreshold:]
-
-		# the returned blocks are put here...
+		# the returned blocks are XORed together here as they arrive...
 		self.returnedxorblocksdict = {}
+		# ...and counted here
+		self.returnedcountdict = {}
 		for blocknum in blocklist:
-			# make these all empty lists to start with
-			self.returnedxorblocksdict[blocknum] = []
+			# nothing has arrived yet
+			self.returnedxorblocksdict[blocknum] = None
+			self.returnedcountdict[blocknum] = 0
 
 		# and here is where they are put when reconstructed
 		self.finishedblockdict = {}
 
-		# preparation done. queries are ready to be sent.
-
 
 	# chunked version:
 	def get_next_xorrequest(self, tid):
@@ -685,16 +760,18 @@ class RandomXORRequestorChunks(Requestor):
 
 		requestinfo = self.activemirrors[tid]
 
+		# the requests of a failed mirror go first
+		if len(requestinfo['resendrequests']) > 0:
+			return self._resend_request(requestinfo)
 
 		if self.parallel:
 			if len(requestinfo['parallelblocksneeded']) == 0:
 				return ()
 
 			blocknums = requestinfo['parallelblocksneeded'].pop(0)
-			requestinfo['blocksrequested'].append(blocknums)
 
 			if self.rng:
-				return (requestinfo['info'], blocknums, requestinfo['blockchunklist'].pop(0), 2)
+				return self._send_request(requestinfo, blocknums, (requestinfo['info'], blocknums, requestinfo['blockchunklist'].pop(0), 2))
 			else:
 				raise Exception("Parallel Query without RNG not yet implemented!")
 
@@ -705,57 +782,11 @@ class RandomXORRequestorChunks(Requestor):
 				return ()
 
 			blocknum = requestinfo['blocksneeded'].pop(0)
-			requestinfo['blocksrequested'].append(blocknum)
 
 			if self.rng:
-				return (requestinfo['info'], blocknum, requestinfo['blockchunklist'].pop(0), 1)
+				return self._send_request(requestinfo, blocknum, (requestinfo['info'], blocknum, requestinfo['blockchunklist'].pop(0), 1))
 			else:
-				return (requestinfo['info'], blocknum, requestinfo['blockchunklist'].pop(0), 0)
-
-
-	def notify_failure(self, xorrequesttuple):
-		"""
-		<Purpose>
-			Handles that a mirror has failed
-
-		<Arguments>
-			The XORrequesttuple that was returned by get_next_xorrequest
-
-		<Exceptions>
-			InsufficientMirrors if there are not enough mirrors
-
-			An internal error is raised if the XORrequesttuple is bogus
-
-		<Returns>
-			None
-
-		"""
-		# I should lock the table...
-		self.tablelock.acquire()
-
-		# but *always* release it
-		try:
-			# if we're out of replacements, quit
-			if len(self.backupmirrorinfolist) == 0:
-				raise InsufficientMirrors("There are no replacement mirrors")
-
-			nextmirrorinfo = self.backupmirrorinfolist.pop(0)
-
-			failedmirrorsinfo = xorrequesttuple[0]
-
-			# now, let's find the activemirror this corresponds to.
-			for mirror in self.activemirrors:
-				if mirror['info'] == failedmirrorsinfo:
-
-					# let's mark it as inactive and set up a different mirror
-					mirror['info'] = nextmirrorinfo
-					return
-
-			raise Exception("InternalError: Unknown mirror in notify_failure")
-
-		finally:
-			# release the lock
-			self.tablelock.release()
+				return self._send_request(requestinfo, blocknum, (requestinfo['info'], blocknum, requestinfo['blockchunklist'].pop(0), 0))
 
 
 	def notify_success(self, thismirrorsinfo, xorblock):
@@ -789,17 +820,33 @@ class RandomXORRequestorChunks(Requestor):
 			for mirror in self.activemirrors:
 				if mirror['info'] == thismirrorsinfo:
 
+					blocknumbers, request = mirror['pendingrequests'].pop(0)
+
+					# only repeated to move a replacement's AES stream along
+					if blocknumbers == None:
+						return
+
+					if self.rng:
+						mirror['answeredrequests'].append(request)
+
 					if self.parallel:
 						#use blocknumbers[0] as index from now on
-						blocknumbers = mirror['blocksrequested'].pop(0)
 
-						# add the xorblocks to the dict
-						self.returnedxorblocksdict[blocknumbers[0]].append(msgpack.unpackb(xorblock, raw=False))
+						# xor the answered chunks into what we have so far
+						accumulators = self.returnedxorblocksdict[blocknumbers[0]]
+						if accumulators == None:
+							accumulators = {}
+							self.returnedxorblocksdict[blocknumbers[0]] = accumulators
+
+						for c, chunk in msgpack.unpackb(xorblock, raw=False).items():
+							accumulators[c] = lib.xor_accumulate(accumulators.get(c), chunk)
+
+						self.returnedcountdict[blocknumbers[0]] = self.returnedcountdict[blocknumbers[0]] + 1
 
 						#print "Appended blocknumber", blocknumbers[0], "from", thismirrorsinfo['port']
 
 						# if we don't have all of the pieces, continue
-						if len(self.returnedxorblocksdict[blocknumbers[0]]) != self.privacythreshold:
+						if self.returnedcountdict[blocknumbers[0]] != self.privacythreshold:
 							return
 
 						# if we have all of the pieces, reconstruct it
@@ -810,7 +857,7 @@ class RandomXORRequestorChunks(Requestor):
 
 						for blocknumber in blocknumbers:
 
-							index = min(int(blocknumber/self.chunklen), self.privacythreshold-1)
+							index = min(blocknumber // self.chunklen, self.privacythreshold-1)
 
 							# let's check the hash...
 							resultingblockhash = lib.find_hash(resultingblockdict[index], self.manifestdict['hashalgorithm'])
@@ -825,24 +872,26 @@ class RandomXORRequestorChunks(Requestor):
 
 						# it should be safe to delete this
 						del self.returnedxorblocksdict[blocknumbers[0]]
+						del self.returnedcountdict[blocknumbers[0]]
 
 						return
 
 
 					#single block query:
 					else:
-					# remove the block and bitstring (asserting they match what we said before)
-						blocknumber = mirror['blocksrequested'].pop(0)
+						# a single block here
+						blocknumber = blocknumbers
 
-						# add the xorblock to the dict
-						self.returnedxorblocksdict[blocknumber].append(xorblock)
+						# xor the xorblock into what we have so far
+						self.returnedxorblocksdict[blocknumber] = lib.xor_accumulate(self.returnedxorblocksdict[blocknumber], xorblock)
+						self.returnedcountdict[blocknumber] = self.returnedcountdict[blocknumber] + 1
 
 						# if we don't have all of the pieces, continue
-						if len(self.returnedxorblocksdict[blocknumber]) != self.privacythreshold:
+						if self.returnedcountdict[blocknumber] != self.privacythreshold:
 							return
 
-						# if we have all of the pieces, reconstruct it
-						resultingblock = _reconstruct_block(self.returnedxorblocksdict[blocknumber])
+						# if we have all of the pieces, the block is reconstructed
+						resultingblock = self.returnedxorblocksdict[blocknumber].tobytes()
 
 						# let's check the hash...
 						resultingblockhash = lib.find_hash(resultingblock, self.manifestdict['hashalgorithm'])
@@ -856,6 +905,7 @@ class RandomXORRequestorChunks(Requestor):
 
 						# it should be safe to delete this
 						del self.returnedxorblocksdict[blocknumber]
+						del self.returnedcountdict[blocknumber]
 						return
 
 			raise Exception("InternalError: Unknown mirror in notify_success")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# tests that a retrieval fails over to a replacement when a mirror connection
+# breaks. The mirrors are served on the loopback interface by the request
+# handler of raidpir_mirror, a relay in front of the handler breaks the
+# connection.
+
+import os
+import socket
+import threading
+
+import fastsimplexordatastore
+import raidpirlib as lib
+import raidpir_client
+import raidpir_mirror
+import session
+import simplexorrequestor
+
+size = 64 # block size in Byte
+num_blocks = 64 # number of blocks
+
+blocks = [os.urandom(size) for _ in range(num_blocks)]
+
+xordatastore = fastsimplexordatastore.XORDatastore(size, num_blocks, "ram", "db_name")
+for blocknum in range(num_blocks):
+	xordatastore.set_data(blocknum * size, blocks[blocknum])
+xordatastore.finalize()
+
+raidpir_mirror._global_myxordatastore = xordatastore
+
+manifestdict = {'blocksize':size, 'blockcount':num_blocks, 'hashalgorithm':'sha256-raw', 'blockhashlist':[lib.find_hash(block, 'sha256-raw') for block in blocks]}
+
+
+def _forward(src, dst):
+	# relays the requests to the mirror until the connection is closed
+	try:
+		while True:
+			message = session.recvmessage(src)
+			session.sendmessage(dst, message)
+			if message == b'' or message == b'Q':
+				return
+	except (OSError, session.SessionEOF):
+		session.sendmessage(dst, b'')
+
+
+def _serve(sock, answers):
+	# serves sock like a mirror. It breaks after answers answers (None: never)
+	if answers == None:
+		raidpir_mirror.ThreadedXORRequestHandler(sock, None, None)
+		sock.close()
+		return
+
+	relaysock, mirrorsock = socket.socketpair()
+	threading.Thread(target=_serve, args=(mirrorsock, None), daemon=True).start()
+	threading.Thread(target=_forward, args=(sock, relaysock), daemon=True).start()
+
+	# PARAMS OK and the answers get through, then the connection breaks
+	for _ in range(answers + 1):
+		session.sendmessage(sock, session.recvmessage(relaysock))
+
+	sock.shutdown(socket.SHUT_RDWR)
+	sock.close()
+
+
+# breakafter says for each connection in the order they are made after how
+# many answers it breaks. None: never, negative: the mirror is offline
+breakafter = []
+
+_create_loopback_connection = socket.create_connection
+
+def _create_connection(address):
+	# connects to a mirror served on the loopback interface instead of address
+	answers = None
+	if len(breakafter) > 0:
+		answers = breakafter.pop(0)
+
+	if answers != None and answers < 0:
+		raise ConnectionRefusedError("mirror is offline")
+
+	listensock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listensock.bind(('127.0.0.1', 0))
+	listensock.listen(1)
+	clientsock = _create_loopback_connection(listensock.getsockname())
+	mirrorsock, _ = listensock.accept()
+	listensock.close()
+
+	threading.Thread(target=_serve, args=(mirrorsock, answers), daemon=True).start()
+	return clientsock
+
+socket.create_connection = _create_connection
+
+
+def _mirrorinfolist(count):
+	return [{'ip':'127.0.0.1', 'port':port} for port in range(62001, 62001 + count)]
+
+
+def _retrieve(rxgobj, blocklist):
+	raidpir_client._request_loop(rxgobj, range(len(rxgobj.activemirrors)), 0)
+	for blocknum in blocklist:
+		assert rxgobj.return_block(blocknum) == blocks[blocknum]
+
+
+blocklist = list(range(0, num_blocks, 5))
+
+# the first mirror breaks before it answers anything
+breakafter[:] = [0]
+rxgobj = simplexorrequestor.RandomXORRequestor(_mirrorinfolist(5), blocklist, manifestdict, 3, False, False)
+_retrieve(rxgobj, blocklist)
+assert rxgobj.failurecount == 1
+rxgobj.cleanup()
+
+# in batch mode, and the first replacement is offline
+breakafter[:] = [3, None, None, -1]
+rxgobj = simplexorrequestor.RandomXORRequestor(_mirrorinfolist(5), blocklist, manifestdict, 3, True, False)
+_retrieve(rxgobj, blocklist)
+assert rxgobj.failurecount == 2
+rxgobj.cleanup()
+
+# chunks without rng, the replacement breaks as well
+breakafter[:] = [None, 2, None, 4]
+rxgobj = simplexorrequestor.RandomXORRequestorChunks(_mirrorinfolist(5), blocklist, manifestdict, 3, 2, False, False, False, False)
+_retrieve(rxgobj, blocklist)
+assert rxgobj.failurecount == 2
+rxgobj.cleanup()
+
+# with rng the replacement has to replay the answered requests. The second
+# batch reuses the requestor, so the first batch is replayed as well
+breakafter[:] = [None, None, None]
+rxgobj = simplexorrequestor.RandomXORRequestorChunks(_mirrorinfolist(5), blocklist, manifestdict, 3, 2, True, False, False, False)
+_retrieve(rxgobj, blocklist)
+breakafter[:] = [len(blocklist) // 2]
+rxgobj.activemirrors[1]['info']['sock'].shutdown(socket.SHUT_RDWR)
+rxgobj.next_batch(list(range(1, num_blocks, 7)))
+_retrieve(rxgobj, list(range(1, num_blocks, 7)))
+assert rxgobj.failurecount == 2
+rxgobj.cleanup()
+
+# parallel queries in batch mode
+blocklist = list(range(0, num_blocks, 3))
+breakafter[:] = [None, 1]
+rxgobj = simplexorrequestor.RandomXORRequestorChunks(_mirrorinfolist(5), blocklist, manifestdict, 3, 3, True, True, True, False)
+_retrieve(rxgobj, blocklist)
+assert rxgobj.failurecount == 1
+rxgobj.cleanup()
+
+# without a replacement the retrieval fails
+breakafter[:] = [0]
+rxgobj = simplexorrequestor.RandomXORRequestor(_mirrorinfolist(3), blocklist, manifestdict, 3, False, False)
+try:
+	_retrieve(rxgobj, blocklist)
+except simplexorrequestor.InsufficientMirrors:
+	pass
+else:
+	print("Retrieved the blocks although a mirror failed and there was no replacement")